@@ -0,0 +1,205 @@
+import asyncio
+import importlib.util
+import logging
+import time
+import xml.etree.ElementTree as ET
+from requests.auth import HTTPDigestAuth
+
+try:
+    import httpx
+    # Transport failures retried later like a throttled listing, not dropped
+    RETRYABLE_ERRORS = (httpx.TimeoutException, httpx.ReadError, httpx.RemoteProtocolError, httpx.ConnectError)
+except ImportError:
+    httpx = None
+    RETRYABLE_ERRORS = ()
+
+from backend.crawler import CrawlState, Frontier, record_scan_stats
+from backend.concurrency import ThrottledError, check_throttled
+from backend.propfind import PropfindParser, PROPFIND_BODY
+from backend.services import WebDAVService, AlistService
+from backend import metrics
+
+logger = logging.getLogger("async-crawler")
+
+# Connection cap per scan. Over HTTP/2 httpx multiplexes every in-flight
+# request on a single connection per origin; HTTP/1.1 servers need one
+# keep-alive connection per in-flight request, up to this cap.
+MAX_CONNECTIONS = 32
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def available():
+    return httpx is not None
+
+
+def _client(concurrency):
+    connections = max(1, min(concurrency, MAX_CONNECTIONS))
+    return httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        verify=False,
+        timeout=60,
+        limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+        headers={"User-Agent": "WebDAV-Monitor-Premium"},
+    )
+
+
+async def _timed(fetch, path):
+    start = time.monotonic()
+    listing = await fetch(path)
+    return time.monotonic() - start, listing
+
+
+async def _crawl(crawl, fetch, root, limit):
+    """Asyncio counterpart of crawler.run_threaded."""
+    frontier = Frontier(crawl, root, limit)
+    pending = {}
+    try:
+        while frontier.has_work(pending):
+            for item in frontier.take(len(pending)):
+                pending[asyncio.ensure_future(_timed(fetch, item[0]))] = item
+
+            timeout = frontier.timeout()
+            if not pending:
+                await asyncio.sleep(timeout or 0.05)
+                continue
+
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                item = pending.pop(t)
+                try:
+                    latency, listing = t.result()
+                except Exception as e:
+                    frontier.finish(item, 0, None, e)
+                else:
+                    frontier.finish(item, latency, listing, None)
+    finally:
+        limit.close()
+
+
+def _webdav_auth(url, username, password, path):
+    """httpx equivalent of the account's negotiated requests auth."""
+    if not username:
+        return None
+    key = (url.rstrip('/'), username, password)
+    cached = WebDAVService._auth_cache.get(key)
+    if cached is None:
+        # Negotiate with one Depth: 0 request so the crawl starts with the right scheme
+        resp = WebDAVService._authed_request(None, 'PROPFIND', url, username, password,
+                                             WebDAVService._target_url(url, path),
+                                             data=PROPFIND_BODY, headers=WebDAVService._propfind_headers('0'),
+                                             timeout=60, verify=False)
+        resp.close()
+        cached = WebDAVService._auth_cache.get(key)
+    if isinstance(cached, HTTPDigestAuth):
+        return httpx.DigestAuth(username, password)
+    return httpx.BasicAuth(username, password)
+
+
+async def _webdav_scan(url, username, password, path, old_state, smart_scan, limit, auth, on_listing):
+    profile = WebDAVService.get_profile(url, username, password)
+    crawl = CrawlState(path, old_state, smart_scan,
+                       unchanged=lambda cur, old: WebDAVService._unchanged(profile, cur, old),
+                       max_depth=50, on_listing=on_listing)
+    headers = WebDAVService._propfind_headers('1')
+
+    async with _client(limit.maximum) as client:
+        async def fetch(p):
+            try:
+                return await fetch_listing(p)
+            except RETRYABLE_ERRORS as e:
+                metrics.listing_failed("webdav", url)
+                raise ThrottledError(f"{type(e).__name__}: {e}")
+            except Exception:
+                metrics.listing_failed("webdav", url)
+                raise
+
+        async def fetch_listing(p):
+            parser = PropfindParser()
+            items = []
+            start = time.monotonic()
+            async with client.stream('PROPFIND', WebDAVService._target_url(url, p), headers=headers,
+                                     content=PROPFIND_BODY, auth=auth) as resp:
+                check_throttled(resp.status_code, resp.headers)
+                resp.raise_for_status()
+                try:
+                    async for chunk in resp.aiter_bytes():
+                        items.extend(parser.feed(chunk))
+                    items.extend(parser.close())
+                except ET.ParseError as e:
+                    logger.error(f"XML Parse error for {p}: {e}")
+                    return {}, []
+                encoding = resp.headers.get('Content-Encoding', '')
+                size = resp.num_bytes_downloaded
+            results, subdirs, missing = WebDAVService._collect_listing(items, url, p)
+            metrics.observe_listing("webdav", url, "PROPFIND", time.monotonic() - start, len(results), size)
+            profile.observe(results.values(), missing, encoding)
+            return results, subdirs
+
+        await _crawl(crawl, fetch, path, limit)
+    return crawl
+
+
+def list_recursive_webdav(url, username, password, path, limit, old_state=None, smart_scan=True, stats=None, on_listing=None):
+    mode_str = "Smart" if smart_scan else "Deep"
+    logger.info(f"Starting {mode_str} WebDAV scan for {path} (Async, in-flight: {limit.current}, max {limit.maximum}, HTTP/2: {HTTP2_AVAILABLE})")
+    start_time = time.time()
+
+    auth = _webdav_auth(url, username, password, path)
+    crawl = asyncio.run(_webdav_scan(url, username, password, path, old_state, smart_scan, limit, auth, on_listing))
+
+    record_scan_stats(stats, limit, crawl)
+    if crawl.summary():
+        logger.info(crawl.summary())
+    logger.info(f"WebDAV Scan finished in {time.time() - start_time:.2f}s. Scanned {len(crawl.visited)} dirs. Total: {len(crawl.results)}. Concurrency converged at {limit.current}.")
+    return crawl.results
+
+
+async def _alist_scan(auth, path, old_state, refresh, smart_scan, limit, on_listing, per_page, force_visit):
+    crawl = CrawlState(path, old_state, smart_scan, unchanged=AlistService._unchanged, max_depth=20, on_listing=on_listing, force_visit=force_visit)
+    list_url = f"{auth.url}/api/fs/list"
+
+    async with _client(limit.maximum) as client:
+        async def post(payload):
+            # Same token handling as AlistService._api_post: one retry with a new token on 401
+            for attempt in range(2):
+                # A (re-)login is a blocking requests call: keep it off the event loop
+                token = await asyncio.to_thread(auth.get)
+                start = time.monotonic()
+                try:
+                    resp = await client.post(list_url, headers={"Authorization": token or ""}, json=payload)
+                except RETRYABLE_ERRORS as e:
+                    metrics.listing_failed("alist", auth.url)
+                    raise ThrottledError(f"{type(e).__name__}: {e}")
+                data = resp.json() if resp.status_code == 200 else None
+                AlistService._observe(auth.url, "/api/fs/list", payload, time.monotonic() - start, resp, data)
+                unauthorized = resp.status_code == 401 or (data is not None and data.get('code') == 401)
+                if unauthorized and attempt == 0 and auth.invalidate(token):
+                    continue
+                return resp, data
+
+        async def fetch(key):
+            p, page, size = AlistService._page_key(key, per_page)
+            resp, data = await post({"path": p, "page": page, "per_page": size, "refresh": refresh})
+            check_throttled(resp.status_code, resp.headers)
+            if data is None:
+                raise Exception(f"HTTP {resp.status_code}")
+            return AlistService._page_listing(p, page, size, data)
+
+        await _crawl(crawl, fetch, path, limit)
+    return crawl
+
+
+def list_recursive_alist(auth, path, limit, old_state=None, refresh=False, smart_scan=True, stats=None, on_listing=None, per_page=200, force_visit=None):
+    mode_str = "Smart" if smart_scan else "Deep"
+    if refresh:
+        mode_str += " refreshing"
+    logger.info(f"Starting {mode_str} Alist scan for {path} (Async, in-flight: {limit.current}, max {limit.maximum}, HTTP/2: {HTTP2_AVAILABLE})")
+    start_time = time.time()
+
+    crawl = asyncio.run(_alist_scan(auth, path, old_state, refresh, smart_scan, limit, on_listing, per_page, force_visit))
+
+    record_scan_stats(stats, limit, crawl)
+    if crawl.summary():
+        logger.info(crawl.summary())
+    logger.info(f"Alist Scan finished in {time.time() - start_time:.2f}s. Scanned {len(crawl.visited)} dirs. Total: {len(crawl.results)}. Concurrency converged at {limit.current}.")
+    return crawl.results
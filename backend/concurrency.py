@@ -0,0 +1,335 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+
+# Longest Retry-After we are willing to honour, in seconds
+MAX_RETRY_AFTER = 300
+# Hard ceiling for the in-flight limit when none is configured
+MAX_LIMIT = 64
+# Requests in flight per host, across all tasks, when the account sets no limit
+HOST_MAX_IN_FLIGHT = int(os.getenv("HOST_MAX_IN_FLIGHT", "32"))
+# Window for the requests-per-second figure reported by HostBudget.snapshot()
+RATE_WINDOW = 10.0
+# Poll interval for an engine waiting on other tasks to free host slots
+BUDGET_POLL = 0.05
+
+# Who new budget leases are accounted to (the running task's name)
+current_owner = contextvars.ContextVar("budget_owner", default="")
+
+
+class ThrottledError(Exception):
+    """A listing failed in a way that means "slow down": 429, 5xx or a timeout.
+
+    The crawl engines retry such directories later instead of dropping them.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def check_throttled(status_code, headers):
+    """Raise ThrottledError for responses that ask the client to back off."""
+    if status_code == 429 or status_code >= 500:
+        raise ThrottledError(f"HTTP {status_code}", parse_retry_after(headers.get('Retry-After')))
+
+
+class AdaptiveLimit:
+    """AIMD controller for the number of listings a scan keeps in flight.
+
+    Every successful listing adds 1/limit (about +1 per round of requests)
+    while latency stays near the best seen so far. Throttling (429/5xx,
+    timeouts) halves the limit, and so does latency climbing past
+    LATENCY_TOLERANCE times the baseline. Decreases happen at most once per
+    observed round trip, so a burst of failures from one round counts once.
+    A Retry-After pauses new submissions until it has passed.
+    """
+
+    LATENCY_TOLERANCE = 2.0
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, initial, maximum=None, minimum=1):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum or initial)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self._lock = threading.Lock()
+        self._ewma = None
+        self._baseline = None
+        self._last_decrease = 0.0
+        self._blocked_until = 0.0
+        self.throttle_events = 0
+        self.retries = 0
+        self.lease = None
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    def blocked_for(self):
+        """Seconds until a Retry-After pause ends (0 when not paused)."""
+        return max(0.0, self._blocked_until - time.monotonic())
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self._last_decrease < (self._ewma or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * factor)
+
+    def on_success(self, latency):
+        with self._lock:
+            self._ewma = latency if self._ewma is None else \
+                self.EWMA_ALPHA * latency + (1 - self.EWMA_ALPHA) * self._ewma
+            if self._baseline is None or self._ewma < self._baseline:
+                self._baseline = self._ewma
+
+            if self._ewma > self.LATENCY_TOLERANCE * self._baseline:
+                self._decrease(0.9)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            self.throttle_events += 1
+            self._decrease(0.5)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    def backoff(self, attempt):
+        """Delay before retrying a throttled directory for the given attempt."""
+        return max(self.blocked_for(), min(2.0 ** attempt, 60.0))
+
+    # Host budget: a crawl also needs a slot of its server's HostBudget per
+    # request. Without a lease these always succeed.
+
+    def acquire_slot(self):
+        return self.lease is None or self.lease.try_acquire()
+
+    def release_slot(self):
+        if self.lease is not None:
+            self.lease.release()
+
+    def budget_wait(self):
+        """Seconds before asking the host budget again after a refusal (0 when not refused)."""
+        return self.lease.retry_in if self.lease is not None else 0.0
+
+    def stop_waiting(self):
+        """Not asking for a slot right now (paused, or nothing to fetch)."""
+        if self.lease is not None:
+            self.lease.stop_waiting()
+
+    def close(self):
+        if self.lease is not None:
+            self.lease.close()
+
+
+class HostBudget:
+    """In-flight and request-rate budget of one server, shared by every scan
+    and refresh talking to it.
+
+    Each user holds a BudgetLease. A request needs a slot: granted while
+    fewer than max_in_flight requests are running on the host, the token
+    bucket allows another request (max_rps, 0 = unlimited) and the lease is
+    within its fair share, max_in_flight split evenly between the active
+    leases. A lease may go past its share while no other lease is waiting.
+    """
+
+    def __init__(self, host, max_in_flight=HOST_MAX_IN_FLIGHT, max_rps=0.0):
+        self.host = host
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_rps = max_rps
+        self.in_flight = 0
+        self.leases = set()
+        self.cond = threading.Condition()
+        self._tokens = 1.0
+        self._refilled = time.monotonic()
+        self._grants = deque()
+
+    def configure(self, max_in_flight=None, max_rps=None):
+        with self.cond:
+            if max_in_flight is not None:
+                self.max_in_flight = max(1, max_in_flight or HOST_MAX_IN_FLIGHT)
+            if max_rps is not None:
+                self.max_rps = max(0.0, max_rps)
+            self.cond.notify_all()
+
+    def lease(self, owner=None):
+        return BudgetLease(self, owner if owner is not None else current_owner.get())
+
+    def fair_share(self):
+        return max(1, math.ceil(self.max_in_flight / max(1, len(self.leases))))
+
+    def _rate_wait(self, now):
+        if not self.max_rps:
+            return 0.0
+        self._tokens = min(max(1.0, self.max_rps), self._tokens + (now - self._refilled) * self.max_rps)
+        self._refilled = now
+        if self._tokens >= 1.0:
+            return 0.0
+        return (1.0 - self._tokens) / self.max_rps
+
+    def _try_acquire(self, lease):
+        """Called with cond held: 0 when a slot was granted, else seconds to wait."""
+        self.leases.add(lease)
+        now = time.monotonic()
+        if self.in_flight >= self.max_in_flight:
+            lease.waiting = True
+            return BUDGET_POLL
+        if lease.in_flight >= self.fair_share() and any(l.waiting for l in self.leases if l is not lease):
+            lease.waiting = True
+            return BUDGET_POLL
+        wait = self._rate_wait(now)
+        if wait:
+            lease.waiting = True
+            return wait
+        if self.max_rps:
+            self._tokens -= 1.0
+        self.in_flight += 1
+        lease.in_flight += 1
+        lease.waiting = False
+        self._grants.append(now)
+        return 0.0
+
+    def _release(self, lease, count=1):
+        with self.cond:
+            count = min(count, lease.in_flight)
+            lease.in_flight -= count
+            self.in_flight -= count
+            self.cond.notify_all()
+
+    def _close(self, lease):
+        self._release(lease, lease.in_flight)
+        with self.cond:
+            self.leases.discard(lease)
+            self.cond.notify_all()
+
+    def snapshot(self):
+        with self.cond:
+            now = time.monotonic()
+            while self._grants and now - self._grants[0] > RATE_WINDOW:
+                self._grants.popleft()
+            owners = {}
+            for lease in self.leases:
+                entry = owners.setdefault(lease.owner or "-", {"owner": lease.owner or "-", "in_flight": 0, "waiting": False})
+                entry["in_flight"] += lease.in_flight
+                entry["waiting"] = entry["waiting"] or lease.waiting
+            return {
+                "host": self.host,
+                "max_in_flight": self.max_in_flight,
+                "max_rps": self.max_rps,
+                "in_flight": self.in_flight,
+                "utilization": round(self.in_flight / self.max_in_flight, 3),
+                "rps": round(len(self._grants) / RATE_WINDOW, 2),
+                "fair_share": self.fair_share(),
+                "users": sorted(owners.values(), key=lambda e: e["owner"]),
+            }
+
+
+class BudgetLease:
+    """One user's (a crawl's or a refresh pool's) share of a HostBudget."""
+
+    def __init__(self, budget, owner=""):
+        self.budget = budget
+        self.owner = owner
+        self.in_flight = 0
+        self.waiting = False
+        self.retry_in = 0.0
+
+    def try_acquire(self):
+        with self.budget.cond:
+            self.retry_in = self.budget._try_acquire(self)
+            return not self.retry_in
+
+    def acquire(self):
+        with self.budget.cond:
+            while True:
+                wait = self.budget._try_acquire(self)
+                if not wait:
+                    return
+                self.budget.cond.wait(wait)
+
+    def release(self):
+        self.budget._release(self)
+
+    def stop_waiting(self):
+        """Withdraw a refused request, so the other leases are no longer held to their fair share for it."""
+        if not self.waiting and not self.retry_in:
+            return
+        with self.budget.cond:
+            self.waiting = False
+            self.retry_in = 0.0
+            self.budget.cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def close(self):
+        """Give back everything still held and stop counting towards the fair share."""
+        self.budget._close(self)
+
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def host_key(url):
+    parsed = urlparse(url or "")
+    return (parsed.netloc or url or "").lower()
+
+
+def budget_for(url, max_in_flight=None, max_rps=None):
+    """The process-wide HostBudget of url's host; limits given here update it."""
+    key = host_key(url)
+    with _budgets_lock:
+        budget = _budgets.get(key)
+        if budget is None:
+            budget = _budgets[key] = HostBudget(key)
+    if max_in_flight is not None or max_rps is not None:
+        budget.configure(max_in_flight, max_rps)
+    return budget
+
+
+def budget_snapshot():
+    """Utilization of every host budget in use, for the API."""
+    with _budgets_lock:
+        budgets = list(_budgets.values())
+    return [b.snapshot() for b in sorted(budgets, key=lambda b: b.host)]
+
+
+def limit_for(concurrency, max_concurrency=0, budget=None):
+    """AdaptiveLimit for a task: starts at concurrency, may grow to max_concurrency (0 = 4x).
+
+    With a HostBudget, requests also count against the host's shared budget.
+    """
+    concurrency = max(1, concurrency)
+    maximum = max_concurrency or min(concurrency * 4, MAX_LIMIT)
+    limit = AdaptiveLimit(concurrency, maximum=max(concurrency, maximum))
+    if budget is not None:
+        limit.lease = budget.lease()
+    return limit
@@ -0,0 +1,345 @@
+import concurrent.futures
+import heapq
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+from backend.concurrency import ThrottledError
+from backend.path_index import PathIndex
+
+logger = logging.getLogger("crawler")
+
+# Attempts per directory when the server keeps throttling
+MAX_ATTEMPTS = 5
+# Slowest listings kept in a run's crawl profile
+PROFILE_SLOWEST = 20
+
+
+class CrawlProfile:
+    """Where the time of a scan went and what smart scan decided, per depth.
+
+    Keeps the PROFILE_SLOWEST slowest listings (path, depth, latency, entries;
+    pages of a paged listing separately) and per depth the directories
+    listed, skipped as unchanged, the entries carried forward by those skips
+    and the listings that failed. Profiles of the crawls of one run are
+    merged (merge_profile) and stored with the run record.
+    """
+
+    def __init__(self, slowest=PROFILE_SLOWEST):
+        self.max_slowest = slowest
+        self._slowest = []
+        self._seq = 0
+        # depth -> [listed, skipped, copied, failed]
+        self._depths = {}
+        # Directories a walker reused itself: timed, but not counted as listed
+        self._reused = set()
+        self.listing_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _depth(self, depth):
+        counts = self._depths.get(depth)
+        if counts is None:
+            counts = self._depths[depth] = [0, 0, 0, 0]
+        return counts
+
+    def _keep(self, seconds, path, depth, entries, page):
+        """Add a listing to the slowest ones if it is among them (min-heap on seconds)."""
+        self._seq += 1
+        item = (seconds, self._seq, path, depth, entries, page)
+        if len(self._slowest) < self.max_slowest:
+            heapq.heappush(self._slowest, item)
+        elif seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def listing(self, key, depth, seconds, entries):
+        """One finished listing; key is the crawl work item (a path or a page of one)."""
+        path, page = (key[0], key[1]) if isinstance(key, tuple) else (key, 1)
+        with self._lock:
+            if page == 1 and key in self._reused:
+                self._reused.discard(key)
+                return
+            self.listing_seconds += seconds
+            if page == 1:
+                self._depth(depth)[0] += 1
+            self._keep(seconds, path, depth, entries, page)
+
+    def skip(self, depth, copied):
+        with self._lock:
+            counts = self._depth(depth)
+            counts[1] += 1
+            counts[2] += copied
+
+    def reused(self, path, depth, copied):
+        """A directory the fetch itself served from stored state (local smart scan)."""
+        with self._lock:
+            self._reused.add(path)
+        self.skip(depth, copied)
+
+    def failed(self, depth):
+        with self._lock:
+            self._depth(depth)[3] += 1
+
+    def merge(self, other):
+        with other._lock:
+            slowest = list(other._slowest)
+            depths = {d: list(c) for d, c in other._depths.items()}
+            seconds = other.listing_seconds
+        with self._lock:
+            self.listing_seconds += seconds
+            for depth, counts in depths.items():
+                mine = self._depth(depth)
+                for i, n in enumerate(counts):
+                    mine[i] += n
+            for seconds, _, *rest in slowest:
+                self._keep(seconds, *rest)
+
+    def as_dict(self):
+        with self._lock:
+            slowest = sorted(self._slowest, reverse=True)
+            depths = sorted(self._depths.items())
+            seconds = self.listing_seconds
+        return {
+            "listing_seconds": round(seconds, 3),
+            "slowest": [{"path": path, "depth": depth, "seconds": round(s, 3), "entries": entries, "page": page}
+                        for s, _, path, depth, entries, page in slowest],
+            "depths": [{"depth": depth, "listed": c[0], "skipped": c[1], "copied": c[2], "failed": c[3]}
+                       for depth, c in depths],
+        }
+
+
+class CrawlState:
+    """Results and smart-scan decisions of one recursive scan.
+
+    The crawl engines (thread pool or asyncio) only fetch listings; every
+    finished listing goes through add_listing(), which merges it into the
+    results and decides which subdirectories still have to be fetched.
+    Only ever called from the engine's coordinating thread/loop.
+
+    unchanged(current_entry, old_entry) tells whether a directory can be
+    skipped, in which case its descendants are carried over from old_state
+    through a PathIndex (built on the first skip unless one is passed in).
+    on_listing(results), if given, sees every fetched listing as soon as it
+    is merged, so changes can be acted on before the crawl finishes.
+    Directories in force_visit are always fetched, never skipped.
+    profile records listing latencies and the skip decisions per depth.
+    """
+
+    def __init__(self, root, old_state=None, smart_scan=True, unchanged=None, max_depth=50, index=None, on_listing=None, force_visit=None):
+        self.old_state = old_state or {}
+        self.force_visit = force_visit or ()
+        self.on_listing = on_listing
+        self.index = index
+        self.smart_scan = smart_scan
+        self.unchanged = unchanged
+        self.max_depth = max_depth
+        self.results = {}
+        self.visited = {root}
+        self.skipped_dirs = 0
+        self.copied_items = 0
+        self.profile = CrawlProfile()
+
+    def copy_descendants(self, skip_path):
+        if self.index is None:
+            self.index = PathIndex(self.old_state)
+        count = 0
+        for k in self.index.descendants(skip_path):
+            self.results[k] = self.old_state[k]
+            count += 1
+        return count
+
+    def add_listing(self, res, subdirs, depth):
+        """Merge one directory listing; return [(subdir, depth)] still to fetch."""
+        self.results.update(res)
+        if self.on_listing:
+            self.on_listing(res)
+        if depth >= self.max_depth:
+            return []
+
+        pending = []
+        for sd_raw in subdirs:
+            sd_clean = sd_raw.rstrip('/')
+            if sd_clean in self.visited:
+                continue
+            self.visited.add(sd_clean)
+
+            if (self.smart_scan and sd_clean not in self.force_visit and sd_clean in self.old_state and sd_clean in res
+                    and self.unchanged(res[sd_clean], self.old_state[sd_clean])):
+                logger.debug(f"SmartScan: Skipping unchanged {sd_clean}")
+                copied = self.copy_descendants(sd_clean)
+                self.skipped_dirs += 1
+                self.copied_items += copied
+                self.profile.skip(depth + 1, copied)
+                continue
+
+            pending.append((sd_raw, depth + 1))
+        return pending
+
+    def summary(self):
+        if self.skipped_dirs:
+            return f"SmartScan skipped {self.skipped_dirs} unchanged dirs, carried forward {self.copied_items} items."
+        return ""
+
+
+class Frontier:
+    """Directories waiting to be listed, shared by the crawl engines.
+
+    Hands out work while fewer than limit.current listings are in flight,
+    feeds finished listings into the CrawlState and the AdaptiveLimit, and
+    schedules retries: directories failing with ThrottledError come back
+    after a backoff (honouring Retry-After) up to MAX_ATTEMPTS; other
+    failures are logged and dropped.
+
+    A fetch may return a third element, follow-up work items for the same
+    directory (e.g. the remaining pages of a paged listing). They go to the
+    front of the queue so a large directory finishes early, and their
+    listings are merged like any other.
+    """
+
+    def __init__(self, crawl, root, limit):
+        self.crawl = crawl
+        self.limit = limit
+        self.queue = deque([(root, 0, 0)])
+        self.delayed = []
+        self._seq = 0
+
+    def has_work(self, in_flight):
+        return bool(in_flight or self.queue or self.delayed)
+
+    def take(self, in_flight):
+        """Items (path, depth, attempt) to start now, given the number in flight."""
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            self.queue.append(heapq.heappop(self.delayed)[2])
+
+        items = []
+        refused = False
+        if not self.limit.blocked_for():
+            while self.queue and in_flight + len(items) < self.limit.current:
+                if not self.limit.acquire_slot():
+                    refused = True
+                    break
+                items.append(self.queue.popleft())
+        if not refused:
+            # Paused by a Retry-After, at our own limit or out of work
+            self.limit.stop_waiting()
+        return items
+
+    def timeout(self):
+        """How long the engine may wait for completions before calling take() again."""
+        timeout = None
+        if self.delayed:
+            timeout = max(0.0, self.delayed[0][0] - time.monotonic())
+        blocked = self.limit.blocked_for() or self.limit.budget_wait()
+        if self.queue and blocked:
+            timeout = blocked if timeout is None else min(timeout, blocked)
+        return timeout
+
+    def finish(self, item, latency, listing, error):
+        p, depth, attempt = item
+        self.limit.release_slot()
+        if isinstance(error, ThrottledError):
+            self.limit.on_throttle(error.retry_after)
+            if attempt + 1 < MAX_ATTEMPTS:
+                delay = self.limit.backoff(attempt)
+                self.limit.retries += 1
+                logger.warning(f"Throttled on {p} ({error}), retrying in {delay:.1f}s. In-flight limit now {self.limit.current}.")
+                self._seq += 1
+                heapq.heappush(self.delayed, (time.monotonic() + delay, self._seq, (p, depth, attempt + 1)))
+            else:
+                logger.error(f"Failed to scan {p}: still throttled after {MAX_ATTEMPTS} attempts ({error})")
+                self.crawl.profile.failed(depth)
+            return
+        if error is not None:
+            logger.error(f"Failed to scan {p}: {error}")
+            self.crawl.profile.failed(depth)
+            return
+
+        self.limit.on_success(latency)
+        res, subdirs = listing[0], listing[1]
+        self.crawl.profile.listing(p, depth, latency, len(res))
+        if len(listing) > 2:
+            self.queue.extendleft((key, depth, 0) for key in reversed(listing[2]))
+        for sd, sd_depth in self.crawl.add_listing(res, subdirs, depth):
+            self.queue.append((sd, sd_depth, 0))
+
+
+def _timed(fetch, path):
+    start = time.monotonic()
+    listing = fetch(path)
+    return time.monotonic() - start, listing
+
+
+def run_threaded(crawl, fetch, root, limit):
+    """Crawl from root on a thread pool; fetch(item) returns (results, subdirs[, follow-ups])."""
+    frontier = Frontier(crawl, root, limit)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=limit.maximum)
+    futures = {}
+
+    try:
+        while frontier.has_work(futures):
+            for item in frontier.take(len(futures)):
+                futures[executor.submit(_timed, fetch, item[0])] = item
+
+            timeout = frontier.timeout()
+            if not futures:
+                time.sleep(timeout or 0.05)
+                continue
+
+            done, _ = concurrent.futures.wait(futures, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in done:
+                item = futures.pop(fut)
+                try:
+                    latency, listing = fut.result()
+                except Exception as e:
+                    frontier.finish(item, 0, None, e)
+                else:
+                    frontier.finish(item, latency, listing, None)
+    finally:
+        executor.shutdown(wait=False)
+        limit.close()
+
+
+def in_sample(path, percent, slot):
+    """Whether path is in this slot's rotating sample of percent% of directories.
+
+    Paths fall into 100 buckets by CRC32 and each slot takes the next
+    percent buckets, so every directory comes up once per 100/percent slots.
+    """
+    if percent <= 0:
+        return False
+    if percent >= 100:
+        return True
+    bucket = zlib.crc32(path.encode('utf-8')) % 100
+    return (bucket - slot * percent) % 100 < percent
+
+
+def merge_profile(stats, profile):
+    """Add a crawl's profile to the run's one in stats['profile']."""
+    if stats is None or profile is None:
+        return
+    if 'profile' in stats:
+        stats['profile'].merge(profile)
+    else:
+        stats['profile'] = profile
+
+
+def record_scan_stats(stats, limit, crawl=None, listed=None, skipped=None, profile=None):
+    """Copy the controller's outcome into the caller's stats dict, if one was given.
+
+    Directory counts and the crawl profile add up over the crawls of one run;
+    by default they come from crawl (directories fetched vs. skipped by smart
+    scan).
+    """
+    if stats is None:
+        return
+    stats['concurrency'] = limit.current
+    stats['throttled'] = limit.throttle_events
+    stats['retries'] = limit.retries
+    if crawl is not None:
+        skipped = crawl.skipped_dirs
+        listed = len(crawl.visited) - skipped
+        profile = crawl.profile
+    merge_profile(stats, profile)
+    stats['dirs_listed'] = stats.get('dirs_listed', 0) + (listed or 0)
+    stats['dirs_skipped'] = stats.get('dirs_skipped', 0) + (skipped or 0)
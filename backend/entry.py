@@ -0,0 +1,86 @@
+import hashlib
+import re
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+# ISO 8601 fractions longer than microseconds (Alist/Go emit nanoseconds)
+_LONG_FRACTION = re.compile(r"(\.\d{6})\d+")
+
+
+def parse_mtime(value):
+    """Epoch seconds from an RFC 1123 date (WebDAV), ISO 8601 (Alist) or a number (local)."""
+    if value is None or value == "":
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        pass
+    try:
+        iso = _LONG_FRACTION.sub(r"\1", value)
+        if iso.endswith("Z"):
+            iso = iso[:-1] + "+00:00"
+        return datetime.fromisoformat(iso).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def parse_size(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def hash_tag(value):
+    """Signed 64-bit hash of an etag/sign string (0 when there is none), fits a SQLite INTEGER."""
+    if not value:
+        return 0
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class Entry:
+    """One file or directory of a scan.
+
+    Scan state holds hundreds of thousands of these, so instead of a dict of
+    strings an entry is four slots: a flag, the size as an int, the mtime as
+    epoch seconds and a 64-bit hash of the etag (WebDAV) or sign (Alist).
+    0 stands for a missing mtime or tag.
+    """
+
+    __slots__ = ("is_dir", "size", "mtime", "tag")
+
+    def __init__(self, is_dir=False, size=0, mtime=0.0, tag=0):
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+        self.tag = tag
+
+    @classmethod
+    def build(cls, is_dir, size=None, mtime=None, tag=None):
+        """Entry from the raw values a server or os.stat reports."""
+        return cls(bool(is_dir), parse_size(size), parse_mtime(mtime), hash_tag(tag))
+
+    @classmethod
+    def from_dict(cls, info):
+        """Entry from the dicts kept by the older JSON state files."""
+        if not isinstance(info, dict):
+            return cls()
+        return cls.build(info.get("is_dir", False), info.get("size"), info.get("mtime"),
+                         info.get("etag") or info.get("sign"))
+
+    def __eq__(self, other):
+        if not isinstance(other, Entry):
+            return NotImplemented
+        return (self.is_dir == other.is_dir and self.size == other.size
+                and self.mtime == other.mtime and self.tag == other.tag)
+
+    def __repr__(self):
+        return f"Entry(is_dir={self.is_dir}, size={self.size}, mtime={self.mtime}, tag={self.tag})"
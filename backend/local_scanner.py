@@ -0,0 +1,161 @@
+import logging
+import os
+import threading
+import time
+from backend.entry import Entry
+from backend.crawler import CrawlState, run_threaded, record_scan_stats, in_sample
+from backend.concurrency import limit_for
+from backend.path_index import get_parent_path
+
+logger = logging.getLogger("local-scanner")
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 10
+
+
+class LocalWalker:
+    """Directory listings of a local tree, fetched by the shared crawl engine.
+
+    Each listing is one os.scandir call. The file type comes from the
+    DirEntry and the size/mtime from DirEntry.stat(), so every entry costs at
+    most one stat, and listings run on the thread pool so slow (FUSE/rclone)
+    mounts are waited on in parallel. Symlinked directories are followed like
+    os.walk(followlinks=True) does, but one that resolves to the same
+    (st_dev, st_ino) as a directory above it is a loop and is not entered.
+
+    Keys are the same as the old os.walk scan: "<dir>/" for directories
+    (the scan root included) and "<dir>/<name>" for files.
+
+    With smart_scan, a directory whose mtime equals the stored one has had
+    no entries added, removed or renamed, so it is not listed: its stored
+    files are reused as they are and only its subdirectories are stat'ed to
+    continue the walk. Files modified in place do not touch the directory
+    mtime; a rotating verify_percent of unchanged directories is listed in
+    full each run (slot picks the slice) to catch those. Reused directories
+    are reported to profile as skipped.
+    """
+
+    def __init__(self, root, old_state=None, smart_scan=False, verify_percent=0, slot=0, profile=None):
+        self.root = root
+        self.profile = profile
+        self.old_state = old_state or {}
+        self.smart_scan = smart_scan and bool(self.old_state)
+        self.verify_percent = verify_percent
+        self.slot = slot
+        self.dirs_scanned = 0
+        self.dirs_reused = 0
+        self.items_found = 0
+        self.loops = 0
+        # path -> (st_dev, st_ino) of every directory queued so far
+        self._ids = {}
+        # stat of queued directories, taken from the parent's DirEntry
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._last_log = time.time()
+
+        st = os.stat(root)
+        self._ids[root] = (st.st_dev, st.st_ino)
+        self._stats[root] = st
+
+        # Stored children per directory, for directories that are reused
+        self._children = {}
+        if self.smart_scan:
+            for k in self.old_state:
+                self._children.setdefault(get_parent_path(k), []).append(k)
+
+    def _is_loop(self, path, dir_id):
+        parent = get_parent_path(path)
+        while parent:
+            if self._ids.get(parent) == dir_id:
+                return True
+            if parent == self.root:
+                return False
+            parent = get_parent_path(parent)
+        return False
+
+    def _add_subdir(self, full_path, sub_st, subdirs):
+        dir_id = (sub_st.st_dev, sub_st.st_ino)
+        if self._is_loop(full_path, dir_id):
+            logger.warning(f"Symlink loop: {full_path} points back to a parent directory, not following it.")
+            with self._lock:
+                self.loops += 1
+            return
+        self._ids[full_path] = dir_id
+        self._stats[full_path] = sub_st
+        subdirs.append(full_path)
+
+    def _unchanged(self, path, st):
+        old = self.old_state.get(path + '/')
+        return (old is not None and old.mtime == st.st_mtime
+                and not in_sample(path, self.verify_percent, self.slot))
+
+    def _reuse(self, path, results, subdirs):
+        """Stored files of an unchanged directory, plus a fresh stat of each subdirectory."""
+        for k in self._children.get(path, ()):
+            if k.endswith('/'):
+                sub = k[:-1]
+                try:
+                    self._add_subdir(sub, os.stat(sub), subdirs)
+                except (PermissionError, OSError):
+                    continue
+            else:
+                results[k] = self.old_state[k]
+
+    def fetch(self, path):
+        results = {}
+        subdirs = []
+        st = self._stats.pop(path, None)
+        try:
+            if st is None:
+                st = os.stat(path)
+            results[path + '/'] = Entry(True, 0, st.st_mtime)
+            if self.smart_scan and self._unchanged(path, st):
+                self._reuse(path, results, subdirs)
+                with self._lock:
+                    self.dirs_reused += 1
+                if self.profile is not None:
+                    self.profile.reused(path, path[len(self.root):].count('/'), len(results) - 1)
+                return results, subdirs
+            with os.scandir(path) as it:
+                for entry in it:
+                    full_path = path + '/' + entry.name
+                    try:
+                        if entry.is_dir():
+                            self._add_subdir(full_path, entry.stat(), subdirs)
+                        else:
+                            file_st = entry.stat()
+                            results[full_path] = Entry(False, file_st.st_size, file_st.st_mtime)
+                    except (PermissionError, OSError):
+                        continue
+        except (PermissionError, OSError) as e:
+            logger.warning(f"Cannot list local directory {path}: {e}")
+            return {}, []
+
+        with self._lock:
+            self.dirs_scanned += 1
+            self.items_found += len(results)
+            now = time.time()
+            if now - self._last_log > PROGRESS_INTERVAL:
+                self._last_log = now
+                logger.info(f"Scanning local path... checked {self.dirs_scanned} directories, found {self.items_found} items so far...")
+        return results, subdirs
+
+
+def scan_local(local_path, old_state=None, smart_scan=False, verify_percent=0, slot=0, concurrency=10, max_concurrency=0, stats=None, on_listing=None):
+    """Scan a local directory tree on a thread pool; returns path -> Entry."""
+    local_path = local_path.rstrip('/')
+    limit = limit_for(concurrency, max_concurrency)
+    mode_str = "Smart" if smart_scan and old_state else "Full"
+    logger.info(f"{mode_str} scan of local path: {local_path} (Threads: {limit.current}, max {limit.maximum})")
+    start_time = time.time()
+
+    crawl = CrawlState(local_path, smart_scan=False, max_depth=256, on_listing=on_listing)
+    walker = LocalWalker(local_path, old_state, smart_scan, verify_percent, slot, profile=crawl.profile)
+    run_threaded(crawl, walker.fetch, local_path, limit)
+
+    record_scan_stats(stats, limit, listed=walker.dirs_scanned, skipped=walker.dirs_reused, profile=crawl.profile)
+    loops = f" Skipped {walker.loops} symlink loops." if walker.loops else ""
+    if walker.dirs_reused:
+        logger.info(f"SmartScan reused {walker.dirs_reused} unchanged local dirs without listing them.")
+    logger.info(f"Local scan finished in {time.time() - start_time:.2f}s. Listed {walker.dirs_scanned} directories. Total: {len(crawl.results)}.{loops}")
+    return crawl.results
@@ -1,13 +1,19 @@
-from fastapi import FastAPI, HTTPException, Body, Depends, Request, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Body, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from backend.models import load_config, save_config, Account, MonitorTask, pwd_context
+from backend.models import read_config, edit_config, flush_config, Account, MonitorTask, pwd_context
 from backend.services import WebDAVService, AlistService
-from backend.scheduler import init_scheduler, update_task_job, run_task
+from backend.scheduler import init_scheduler, update_task_job, queue_task
+from backend.scan_queue import PRIORITY_MANUAL
+from backend.concurrency import budget_snapshot
+from backend.sessions import session_registry
+from backend import metrics
+from backend.run_log import get_run_log, task_runtime
 from backend.watcher import WatcherManager
 import os
+import secrets
 import uuid
 import time
 from datetime import datetime, timedelta
@@ -80,6 +86,8 @@ async def lifespan(app: FastAPI):
     WatcherManager.update_watchers()
     yield
     logger.info("Shutting down...")
+    flush_config()
+    session_registry.close_all()
 
 app = FastAPI(title="WebDAV Monitor Premium API", lifespan=lifespan)
 
@@ -119,7 +127,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 
 @app.post("/api/auth/login")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    config = load_config()
+    config = read_config()
     logger.info(f"Login attempt for user: {form_data.username}")
     
     if form_data.username != config.settings.username:
@@ -136,7 +144,9 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 
 @app.get("/api/config")
 def get_config(current_user: str = Depends(get_current_user)):
-    return load_config()
+    config = read_config()
+    # Status and last run are kept in memory, not in config.json
+    return config.model_copy(update={"tasks": [task_runtime.apply(t) for t in config.tasks]})
 
 @app.get("/api/logs")
 def get_logs(current_user: str = Depends(get_current_user)):
@@ -144,62 +154,67 @@ def get_logs(current_user: str = Depends(get_current_user)):
 
 @app.get("/api/settings")
 def get_settings(current_user: str = Depends(get_current_user)):
-    config = load_config()
+    config = read_config()
     return config.settings
 
 @app.put("/api/settings")
 def update_settings(settings: dict, current_user: str = Depends(get_current_user)):
-    config = load_config()
-    if "language" in settings:
-        config.settings.language = settings["language"]
-    if "password" in settings and settings["password"]:
-        config.settings.password_hash = pwd_context.hash(settings["password"])
-    save_config(config)
+    password_hash = pwd_context.hash(settings["password"]) if settings.get("password") else None
+    with edit_config() as config:
+        if "language" in settings:
+            config.settings.language = settings["language"]
+        if password_hash:
+            config.settings.password_hash = password_hash
     return config.settings
 
 @app.put("/api/avatar")
 def update_avatar(data: dict, current_user: str = Depends(get_current_user)):
-    config = load_config()
     avatar_data = data.get("avatar", "")
     if len(avatar_data) > 500000:
         from fastapi import HTTPException
         raise HTTPException(status_code=400, detail="Image too large (max 500KB)")
-    config.settings.avatar = avatar_data
-    save_config(config)
-    return {"avatar": config.settings.avatar}
+    with edit_config() as config:
+        config.settings.avatar = avatar_data
+    return {"avatar": avatar_data}
 
 @app.post("/api/accounts")
 def add_account(account: Account, current_user: str = Depends(get_current_user)):
-    config = load_config()
     if not account.id:
         account.id = str(uuid.uuid4())
-    config.accounts.append(account)
-    save_config(config)
+    with edit_config() as config:
+        config.accounts.append(account)
     return account
 
 @app.put("/api/accounts/{account_id}")
 def update_account(account_id: str, account: Account, current_user: str = Depends(get_current_user)):
-    config = load_config()
-    for i, acc in enumerate(config.accounts):
-        if acc.id == account_id:
-            config.accounts[i] = account
-            save_config(config)
-            return account
+    with edit_config() as config:
+        for i, acc in enumerate(config.accounts):
+            if acc.id == account_id:
+                config.accounts[i] = account
+                # URL or credentials may have changed: drop the pooled connections
+                session_registry.invalidate(acc.url, acc.username)
+                session_registry.invalidate(account.url, account.username)
+                return account
     raise HTTPException(status_code=404, detail="Account not found")
 
 @app.delete("/api/accounts/{account_id}")
 def delete_account(account_id: str, current_user: str = Depends(get_current_user)):
-    config = load_config()
     from backend.scheduler import scheduler
-    tasks_to_remove = [t for t in config.tasks if t.src_account_id == account_id or t.dst_account_id == account_id]
+    with edit_config() as config:
+        tasks_to_remove = [t for t in config.tasks if t.src_account_id == account_id or t.dst_account_id == account_id]
+        for task in tasks_to_remove:
+            if scheduler.get_job(task.id):
+                scheduler.remove_job(task.id)
+        
+        config.tasks = [t for t in config.tasks if t.src_account_id != account_id and t.dst_account_id != account_id]
+        removed = [a for a in config.accounts if a.id == account_id]
+        config.accounts = [a for a in config.accounts if a.id != account_id]
+    for acc in removed:
+        session_registry.invalidate(acc.url, acc.username)
     for task in tasks_to_remove:
-        if scheduler.get_job(task.id):
-            scheduler.remove_job(task.id)
-    
-    config.tasks = [t for t in config.tasks if t.src_account_id != account_id and t.dst_account_id != account_id]
-    config.accounts = [a for a in config.accounts if a.id != account_id]
+        get_run_log().delete_task(task.id)
+        task_runtime.forget(task.id)
     
-    save_config(config)
     WatcherManager.update_watchers()
     return {"message": "Deleted account and associated tasks"}
 
@@ -213,7 +228,7 @@ def test_account(account: Account, current_user: str = Depends(get_current_user)
 
 @app.post("/api/accounts/{account_id}/ls")
 def list_account_dir(account_id: str, path: str = Body(..., embed=True), current_user: str = Depends(get_current_user)):
-    config = load_config()
+    config = read_config()
     account = next((a for a in config.accounts if a.id == account_id), None)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
@@ -221,10 +236,10 @@ def list_account_dir(account_id: str, path: str = Body(..., embed=True), current
     if account.type == "webdav":
         return WebDAVService.list_directory(account.url, account.username, account.password, path)
     else:
-        token = account.token or AlistService.get_token(account.url, account.username, account.password)
-        if not token:
+        auth = AlistService.get_auth(account.url, account.username, account.password, account.token)
+        if not auth.get():
             raise HTTPException(status_code=400, detail="Could not get Alist token")
-        return AlistService.list_directory(account.url, token, path)
+        return AlistService.list_directory(auth, path, account.per_page)
 
 @app.post("/api/local/list")
 def list_local_dir(path: str = Body(..., embed=True), current_user: str = Depends(get_current_user)):
@@ -254,32 +269,35 @@ def list_local_dir(path: str = Body(..., embed=True), current_user: str = Depend
 
 @app.post("/api/tasks")
 def add_task(task: MonitorTask, current_user: str = Depends(get_current_user)):
-    config = load_config()
     if not task.id:
         task.id = str(uuid.uuid4())
-    config.tasks.append(task)
-    save_config(config)
+    with edit_config() as config:
+        config.tasks.append(task)
     update_task_job(task)
     WatcherManager.update_watchers()
     return task
 
 @app.put("/api/tasks/{task_id}")
 def update_task(task_id: str, task: MonitorTask, current_user: str = Depends(get_current_user)):
-    config = load_config()
-    for i, t in enumerate(config.tasks):
-        if t.id == task_id:
-            config.tasks[i] = task
-            save_config(config)
-            update_task_job(task)
-            WatcherManager.update_watchers()
-            return task
+    with edit_config() as config:
+        found = False
+        for i, t in enumerate(config.tasks):
+            if t.id == task_id:
+                config.tasks[i] = task
+                found = True
+                break
+    if found:
+        update_task_job(task)
+        WatcherManager.update_watchers()
+        return task
     raise HTTPException(status_code=404, detail="Task not found")
 
 @app.delete("/api/tasks/{task_id}")
 def delete_task(task_id: str, current_user: str = Depends(get_current_user)):
-    config = load_config()
-    config.tasks = [t for t in config.tasks if t.id != task_id]
-    save_config(config)
+    with edit_config() as config:
+        config.tasks = [t for t in config.tasks if t.id != task_id]
+    get_run_log().delete_task(task_id)
+    task_runtime.forget(task_id)
     WatcherManager.update_watchers()
     from backend.scheduler import scheduler
     if scheduler.get_job(task_id):
@@ -287,29 +305,55 @@ def delete_task(task_id: str, current_user: str = Depends(get_current_user)):
     return {"message": "Deleted"}
 
 @app.post("/api/tasks/{task_id}/run")
-def trigger_task(task_id: str, background_tasks: BackgroundTasks, current_user: str = Depends(get_current_user)):
-    config = load_config()
-    task = next((t for t in config.tasks if t.id == task_id), None)
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
-    if not task.enabled:
-        task.enabled = True
-        task.status = "idle"
-        save_config(config)
-        logger.info(f"Re-enabled task {task.name} for manual run.")
-    background_tasks.add_task(run_task, task_id)
+def trigger_task(task_id: str, current_user: str = Depends(get_current_user)):
+    with edit_config() as config:
+        task = next((t for t in config.tasks if t.id == task_id), None)
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found")
+        if not task.enabled:
+            task.enabled = True
+            task_runtime.update(task_id, status="idle")
+            logger.info(f"Re-enabled task {task.name} for manual run.")
+    # Manual runs go ahead of scheduled ones in the scan queue
+    queue_task(task_id, PRIORITY_MANUAL)
     return {"message": "Task triggered"}
 
 @app.get("/api/tasks/{task_id}/history")
-def get_task_history(task_id: str, current_user: str = Depends(get_current_user)):
-    config = load_config()
-    records = [r.model_dump() for r in config.task_history if r.task_id == task_id]
-    return records[-50:]
+def get_task_history(task_id: str, since: Optional[str] = None, until: Optional[str] = None, limit: int = 50, current_user: str = Depends(get_current_user)):
+    return get_run_log().query(task_id, since=since, until=until, limit=limit)
+
+@app.get("/api/tasks/{task_id}/history/{run_id}/profile")
+def get_run_profile(task_id: str, run_id: int, current_user: str = Depends(get_current_user)):
+    profile = get_run_log().profile(task_id, run_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="No crawl profile for this run")
+    return profile
 
 @app.get("/api/stats/history")
-def get_stats_history(current_user: str = Depends(get_current_user)):
-    config = load_config()
-    return [r.model_dump() for r in config.task_history]
+def get_stats_history(since: Optional[str] = None, until: Optional[str] = None, limit: int = 1000, current_user: str = Depends(get_current_user)):
+    return get_run_log().query(since=since, until=until, limit=limit)
+
+# Prometheus scrape endpoint. Scrapers send "Authorization: Bearer <token>"
+# with METRICS_TOKEN or a login JWT; METRICS_PUBLIC=1 allows anonymous scrapes.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "").lower() in ("1", "true", "yes")
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    if not metrics.available():
+        raise HTTPException(status_code=503, detail="prometheus_client is not installed")
+    if not METRICS_PUBLIC:
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+        if not (METRICS_TOKEN and secrets.compare_digest(token, METRICS_TOKEN)):
+            await get_current_user(token)
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/api/stats/hosts")
+def get_host_stats(current_user: str = Depends(get_current_user)):
+    return budget_snapshot()
 
 @app.get("/api/wallpaper")
 def get_wallpapers():
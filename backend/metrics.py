@@ -0,0 +1,104 @@
+from backend.concurrency import host_key
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:
+    prometheus_client = None
+
+# Listing latencies run from LAN round trips to slow cloud-drive refreshes
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RUN_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+
+
+def available():
+    return prometheus_client is not None
+
+
+# Prometheus metrics of the scanners, refreshes, scan queue and task runs.
+# prometheus_client is optional: without it every helper below is a no-op.
+# Service-level metrics are labelled with the account's host (crawl worker
+# threads do not know which task they serve); run-level ones with the task.
+if prometheus_client is not None:
+    LISTING_SECONDS = Histogram("webdav_monitor_listing_seconds", "Latency of one directory listing request (PROPFIND or fs/list)",
+                                ["service", "account", "method"], buckets=LATENCY_BUCKETS)
+    LISTING_ERRORS = Counter("webdav_monitor_listing_errors_total", "Listing requests that failed or were throttled",
+                             ["service", "account"])
+    ENTRIES_PARSED = Counter("webdav_monitor_entries_parsed_total", "Entries parsed from listing responses", ["service", "account"])
+    BYTES_RECEIVED = Counter("webdav_monitor_bytes_received_total", "Listing response bytes received", ["service", "account"])
+    REFRESH_SECONDS = Histogram("webdav_monitor_refresh_seconds", "Latency of Alist directory refreshes", ["account"],
+                                buckets=LATENCY_BUCKETS)
+    REFRESH_FAILURES = Counter("webdav_monitor_refresh_failures_total", "Alist directory refreshes that failed", ["account"])
+    RUN_SECONDS = Histogram("webdav_monitor_run_seconds", "Duration of task runs", ["task", "status"], buckets=RUN_BUCKETS)
+    RUN_DIRS_LISTED = Counter("webdav_monitor_run_dirs_listed_total", "Directories listed by task runs", ["task"])
+    RUN_DIRS_SKIPPED = Counter("webdav_monitor_run_dirs_skipped_total", "Directories smart scan skipped as unchanged", ["task"])
+    RUN_DIRS_PER_SECOND = Gauge("webdav_monitor_run_dirs_per_second", "Directories listed per second in the task's last run", ["task"])
+    RUN_SKIP_RATIO = Gauge("webdav_monitor_run_skip_ratio", "Share of directories smart scan skipped in the task's last run", ["task"])
+    RUN_ITEMS = Gauge("webdav_monitor_run_items", "Entries found by the task's last run", ["task"])
+    RUN_CHANGES = Counter("webdav_monitor_run_changes_total", "Changes detected by task runs", ["task", "kind"])
+    QUEUE_DEPTH = Gauge("webdav_monitor_queue_depth", "Jobs waiting in the scan queue")
+    QUEUE_COALESCING = Gauge("webdav_monitor_queue_coalescing_dirs", "Directories with watcher events waiting for their quiet period")
+    QUEUE_RUNNING = Gauge("webdav_monitor_queue_running", "Scan jobs being processed")
+    QUEUE_WAIT_SECONDS = Histogram("webdav_monitor_queue_wait_seconds", "Time jobs waited in the scan queue", ["job_type"],
+                                   buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600))
+
+
+def observe_listing(service, url, method, seconds, entries=0, size=0):
+    if prometheus_client is None:
+        return
+    account = host_key(url)
+    LISTING_SECONDS.labels(service, account, method).observe(seconds)
+    if entries:
+        ENTRIES_PARSED.labels(service, account).inc(entries)
+    if size:
+        BYTES_RECEIVED.labels(service, account).inc(size)
+
+
+def listing_failed(service, url):
+    if prometheus_client is not None:
+        LISTING_ERRORS.labels(service, host_key(url)).inc()
+
+
+def observe_refresh(url, seconds, ok):
+    if prometheus_client is None:
+        return
+    account = host_key(url)
+    REFRESH_SECONDS.labels(account).observe(seconds)
+    if not ok:
+        REFRESH_FAILURES.labels(account).inc()
+
+
+def observe_run(task, status, seconds, stats, items=0, new=0, modified=0, deleted=0):
+    """Record a finished run; stats is the scan_stats dict the scanners filled."""
+    if prometheus_client is None:
+        return
+    RUN_SECONDS.labels(task, status).observe(seconds)
+    RUN_ITEMS.labels(task).set(items)
+    for kind, count in (("new", new), ("modified", modified), ("deleted", deleted)):
+        if count:
+            RUN_CHANGES.labels(task, kind).inc(count)
+    listed = stats.get('dirs_listed', 0)
+    skipped = stats.get('dirs_skipped', 0)
+    RUN_DIRS_LISTED.labels(task).inc(listed)
+    RUN_DIRS_SKIPPED.labels(task).inc(skipped)
+    RUN_DIRS_PER_SECOND.labels(task).set(listed / seconds if seconds > 0 else 0)
+    RUN_SKIP_RATIO.labels(task).set(skipped / (listed + skipped) if listed + skipped else 0)
+
+
+def observe_queue_wait(job_type, seconds):
+    if prometheus_client is not None:
+        QUEUE_WAIT_SECONDS.labels(job_type).observe(seconds)
+
+
+def track_queue(queue):
+    """Read the queue's depth and running jobs at scrape time."""
+    if prometheus_client is None:
+        return
+    QUEUE_DEPTH.set_function(queue.size)
+    QUEUE_COALESCING.set_function(queue.coalescing_size)
+    QUEUE_RUNNING.set_function(queue.running_count)
+
+
+def render():
+    """(body, content type) of the current metrics."""
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
@@ -1,10 +1,17 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict
+import atexit
 import json
 import os
+import tempfile
+import threading
+from contextlib import contextmanager
 from passlib.context import CryptContext
 
 CONFIG_PATH = os.getenv("CONFIG_PATH", "data/config.json")
+# Read once at import: os.umask() can only be queried by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 class Account(BaseModel):
@@ -15,6 +22,12 @@ class Account(BaseModel):
     username: Optional[str] = None
     password: Optional[str] = None
     token: Optional[str] = None
+    # Alist page size for directory listings (0 = everything in one page)
+    per_page: int = 200
+    # Budget of the account's host, shared by every task using it:
+    # requests in flight (0 = HOST_MAX_IN_FLIGHT) and per second (0 = unlimited)
+    max_in_flight: int = 0
+    max_rps: float = 0
 
 class MonitorTask(BaseModel):
     id: Optional[str] = None
@@ -25,14 +38,30 @@ class MonitorTask(BaseModel):
     src_type: str = "webdav"
     dst_path: Optional[str] = "/"
     concurrency: int = 10
+    max_concurrency: int = 0
     interval: int = 600
     enabled: bool = True
+    # Runtime values, kept in memory (backend.run_log.TaskRuntime) and only
+    # filled in when the config is served
     last_run: Optional[str] = None
     status: str = "idle"
     refresh_source: bool = False
+    # "full": every listing refreshes upstream; "changed": only directories
+    # that look changed in Alist's cache, plus a rotating sample (percent)
+    refresh_mode: str = "full"
+    refresh_sample: int = 5
     refresh_destination: bool = True
     use_polling: bool = False
     smart_scan: bool = True
+    # Local sources only skip directories whose mtime is unchanged when
+    # opted in: a skipped directory hides files edited in place, and
+    # directory mtimes are unreliable on many FUSE/rclone mounts
+    local_mtime_skip: bool = False
+    # Percent of those unchanged directories still listed in full each run,
+    # rotating, to catch files modified in place
+    verify_sample: int = 0
+    depth_infinity: bool = False
+    engine: str = "threads"
     schedule_type: str = "interval"
     cron_expr: str = ""
     max_retries: int = 0
@@ -50,6 +79,10 @@ class TaskRunRecord(BaseModel):
     modified_files: int = 0
     deleted_files: int = 0
     dirs_refreshed: int = 0
+    refresh_failed: int = 0
+    refresh_failed_paths: List[str] = []
+    concurrency: int = 0
+    throttled: int = 0
     error_message: str = ""
 
 class UserSettings(BaseModel):
@@ -62,19 +95,50 @@ class Config(BaseModel):
     accounts: List[Account] = []
     tasks: List[MonitorTask] = []
     settings: UserSettings = UserSettings()
+    # Only read to move old history into the run log (backend.run_log)
     task_history: List[TaskRunRecord] = []
 
-def load_config() -> Config:
+def _default_config() -> Config:
+    default_hash = pwd_context.hash("admin")
+    return Config(settings=UserSettings(password_hash=default_hash))
+
+def _config_file_mode():
+    """Mode for a rewritten config.json: the current file's, else the umask default."""
+    try:
+        return os.stat(CONFIG_PATH).st_mode & 0o777
+    except OSError:
+        return 0o666 & ~_UMASK
+
+def _write_config_file(config: Config) -> bool:
+    """Write config.json atomically: a temp file in the same directory, then rename.
+
+    Returns False (after printing the error) when the write failed."""
+    try:
+        directory = os.path.dirname(os.path.abspath(CONFIG_PATH))
+        os.makedirs(directory, exist_ok=True)
+        data = config.model_dump() if hasattr(config, "model_dump") else config.dict()
+        fd, tmp_path = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            # mkstemp creates the file 0600
+            os.chmod(tmp_path, _config_file_mode())
+            os.replace(tmp_path, CONFIG_PATH)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return True
+    except Exception as e:
+        print(f"Error saving config: {e}")
+        return False
+
+def _read_config_file() -> Config:
     config_updated = False
     
-    def get_default():
-        default_hash = pwd_context.hash("admin")
-        return Config(settings=UserSettings(password_hash=default_hash))
-
     if not os.path.exists(CONFIG_PATH):
         os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
-        config = get_default()
-        save_config(config)
+        config = _default_config()
+        _write_config_file(config)
         return config
     
     try:
@@ -85,13 +149,12 @@ def load_config() -> Config:
             data = json.loads(content)
     except (json.JSONDecodeError, ValueError, Exception) as e:
         print(f"Config corrupted, resetting to default: {e}")
-        config = get_default()
+        config = _default_config()
         try:
-            save_config(config)
+            _write_config_file(config)
         except Exception as save_err:
             print(f"Critical error: Could not reset config file: {save_err}")
         return config
-        
     if "settings" not in data:
         data["settings"] = UserSettings(password_hash=pwd_context.hash("admin")).model_dump()
         config_updated = True
@@ -121,9 +184,9 @@ def load_config() -> Config:
         print(f"Config structure error: {e}. Attempting to recover...")
         if not isinstance(data, dict) or "accounts" not in data or "tasks" not in data:
             print("Critical sections missing or invalid format. Resetting.")
-            config = get_default()
+            config = _default_config()
             try:
-                save_config(config)
+                _write_config_file(config)
             except: pass
             return config
             
@@ -139,18 +202,109 @@ def load_config() -> Config:
             settings=settings_obj
         )
         try:
-            save_config(config)
+            _write_config_file(config)
         except: pass
 
     if config_updated:
-        save_config(config)
+        _write_config_file(config)
     return config
 
-def save_config(config: Config):
-    try:
-        os.makedirs(os.path.dirname(os.path.abspath(CONFIG_PATH)), exist_ok=True)
-        with open(CONFIG_PATH, "w", encoding='utf-8') as f:
-            data = config.model_dump() if hasattr(config, "model_dump") else config.dict()
-            json.dump(data, f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        print(f"Error saving config: {e}")
+
+class ConfigRepository:
+    """Process-wide copy of config.json.
+
+    The file is parsed once and parsed again only when its mtime or size
+    changes behind our back (e.g. edited by hand). Changes are made in place
+    on the shared copy inside edit() under one lock, so concurrent writers
+    no longer overwrite each other with stale snapshots. Writes are
+    coalesced: edit() only marks the copy dirty and a timer writes it
+    WRITE_DELAY seconds later (temp file + rename); flush() writes at once.
+    A failed write leaves the changes pending and is retried after
+    RETRY_DELAY seconds.
+    """
+
+    WRITE_DELAY = 1.0
+    RETRY_DELAY = 30.0
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._config: Optional[Config] = None
+        self._stamp = None
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+
+    @staticmethod
+    def _file_stamp():
+        try:
+            st = os.stat(CONFIG_PATH)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def get(self) -> Config:
+        """The shared config; callers must not modify it outside edit()."""
+        with self._lock:
+            stamp = self._file_stamp()
+            if self._config is None or (not self._dirty and stamp != self._stamp):
+                self._config = _read_config_file()
+                self._stamp = self._file_stamp()
+            return self._config
+
+    @contextmanager
+    def edit(self):
+        """Modify the shared config in place; the write happens shortly after.
+
+        Edits are not rolled back: if the block raises, whatever it already
+        changed stays in the shared copy, so it is marked dirty and written
+        like a completed edit rather than left unsaved for readers to see.
+        """
+        with self._lock:
+            config = self.get()
+            try:
+                yield config
+            finally:
+                self._dirty = True
+                self._schedule(self.WRITE_DELAY)
+
+    def _schedule(self, delay):
+        """Called with _lock held: write in delay seconds unless a write is already due."""
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> bool:
+        """Write pending changes now; False if the write failed (it is retried later)."""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return True
+                self._dirty = False
+                snapshot = self._config.model_copy(deep=True)
+            ok = _write_config_file(snapshot)
+            with self._lock:
+                if not ok:
+                    self._dirty = True
+                    self._schedule(self.RETRY_DELAY)
+                elif not self._dirty:
+                    self._stamp = self._file_stamp()
+            return ok
+
+config_repository = ConfigRepository()
+# Pending changes are written at shutdown instead of when the timer fires
+atexit.register(config_repository.flush)
+
+def read_config() -> Config:
+    """Shared, cached config for read-only use."""
+    return config_repository.get()
+
+def edit_config():
+    """Context manager yielding the shared config for in-place changes."""
+    return config_repository.edit()
+
+def flush_config() -> bool:
+    return config_repository.flush()
@@ -0,0 +1,37 @@
+from bisect import bisect_left
+
+
+def get_parent_path(file_href: str) -> str:
+    parts = file_href.rstrip('/').split('/')
+    if len(parts) <= 1:
+        return "/"
+    return "/".join(parts[:-1])
+
+
+class PathIndex:
+    """Sorted view of a state dict's keys for subtree lookups.
+
+    All keys below "/a/b" sort between "/a/b/" and "/a/b0" ('0' is the
+    character right after '/'), so a subtree is a contiguous slice found with
+    two binary searches and copying it costs O(log n + subtree size).
+    """
+
+    def __init__(self, state, sorted_keys=None):
+        self.state = state
+        self.keys = sorted_keys if sorted_keys is not None else sorted(state)
+
+    def subtree_range(self, path):
+        """(lo, hi) slice of self.keys holding the descendants of path."""
+        base = path.rstrip('/')
+        lo = bisect_left(self.keys, base + '/')
+        hi = bisect_left(self.keys, base + '0', lo)
+        return lo, hi
+
+    def descendants(self, path):
+        """Keys strictly below path (a local dir's own "path/" key is excluded)."""
+        prefix = path.rstrip('/') + '/'
+        lo, hi = self.subtree_range(path)
+        for i in range(lo, hi):
+            k = self.keys[i]
+            if k != prefix:
+                yield k
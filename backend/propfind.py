@@ -0,0 +1,246 @@
+import threading
+from collections import deque
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote
+
+# Size of the blocks pulled off the socket. Entries are yielded as soon as
+# their closing </response> arrives, so memory stays flat however large the
+# directory is.
+CHUNK_SIZE = 64 * 1024
+
+# Namespaces accepted for DAV elements. Some servers emit the DAV elements
+# without any namespace at all, so the empty namespace is tolerated as well.
+DAV_NAMESPACES = ("DAV:", "")
+
+# The only properties the scanners look at. Asking for them explicitly keeps
+# servers from sending every dead property, lock and quota (allprop).
+CRAWL_PROPS = ("resourcetype", "getlastmodified", "getetag", "getcontentlength")
+
+PROPFIND_BODY = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<D:propfind xmlns:D="DAV:"><D:prop>'
+    + "".join(f"<D:{name}/>" for name in CRAWL_PROPS)
+    + "</D:prop></D:propfind>"
+).encode("utf-8")
+
+PROPFIND_HEADERS = {
+    "Content-Type": 'application/xml; charset="utf-8"',
+    "Accept-Encoding": "gzip",
+}
+
+
+def _split_tag(tag):
+    """Return (namespace, local_name) for an ElementTree '{ns}name' tag."""
+    if tag[:1] == "{":
+        ns, _, local = tag[1:].partition("}")
+        return ns, local
+    return "", tag
+
+
+def _is_dav(elem, name):
+    ns, local = _split_tag(elem.tag)
+    return local == name and ns in DAV_NAMESPACES
+
+
+def _find_dav(elem, name):
+    for child in elem:
+        if _is_dav(child, name):
+            return child
+    return None
+
+
+def _text(elem):
+    if elem is None or elem.text is None:
+        return ""
+    return elem.text.strip()
+
+
+def _status_ok(propstat):
+    status = _text(_find_dav(propstat, "status"))
+    if not status:
+        return True
+    parts = status.split()
+    return len(parts) > 1 and parts[1].startswith("2")
+
+
+def parse_response(elem):
+    """Turn a single DAV:response element into an entry dict.
+
+    Only properties reported under a 2xx propstat are used; properties the
+    server answered with any other status are listed under "missing".
+    "href" is percent-decoded; "raw_href" is the href exactly as sent.
+    """
+    raw_href = _text(_find_dav(elem, "href"))
+    props = {}
+    missing = []
+
+    for propstat in elem:
+        if not _is_dav(propstat, "propstat"):
+            continue
+        prop = _find_dav(propstat, "prop")
+        if prop is None:
+            continue
+        ok = _status_ok(propstat)
+        for p in prop:
+            ns, local = _split_tag(p.tag)
+            if ns not in DAV_NAMESPACES:
+                continue
+            if ok:
+                props.setdefault(local, p)
+            else:
+                missing.append(local)
+
+    resourcetype = props.get("resourcetype")
+    is_dir = resourcetype is not None and _find_dav(resourcetype, "collection") is not None
+
+    return {
+        "href": unquote(raw_href),
+        "raw_href": raw_href,
+        "is_dir": is_dir,
+        "mtime": _text(props.get("getlastmodified")),
+        "etag": _text(props.get("getetag")),
+        "size": _text(props.get("getcontentlength")) or "0",
+        "missing": missing,
+    }
+
+
+class PropfindParser:
+    """Incremental parser for 207 Multi-Status bodies.
+
+    Feed raw bytes with feed(); every call returns the entries completed by
+    that chunk. Finished response elements are dropped from the tree right
+    away, so only one <response> is ever held in memory.
+    """
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root = None
+        self._depth = 0
+
+    def _drain(self):
+        entries = []
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                if self._root is None:
+                    self._root = elem
+                self._depth += 1
+                continue
+
+            self._depth -= 1
+            # Direct children of <multistatus> are the <response> elements
+            if self._depth == 1 and _is_dav(elem, "response"):
+                entries.append(parse_response(elem))
+                self._root.clear()
+        return entries
+
+    def feed(self, data):
+        self._parser.feed(data)
+        return self._drain()
+
+    def close(self):
+        self._parser.close()
+        return self._drain()
+
+
+def iter_propfind(resp, chunk_size=CHUNK_SIZE):
+    """Yield entries from a streamed (stream=True) requests PROPFIND response.
+
+    Reads resp.raw directly, letting urllib3 undo any Content-Encoding.
+    Raises xml.etree.ElementTree.ParseError on malformed XML.
+    """
+    parser = PropfindParser()
+    while True:
+        chunk = resp.raw.read(chunk_size, decode_content=True)
+        if not chunk:
+            break
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+class ServerProfile:
+    """Capabilities of one WebDAV account, learned from its responses.
+
+    Filled in by every listing and kept for the life of the process:
+    which of CRAWL_PROPS the last listing lacked, whether responses come
+    compressed, whether Depth: infinity is allowed, and whether directory
+    mtimes and etags can be used to skip unchanged subtrees. A signal is
+    distrusted while most of the last WINDOW directory entries came without
+    it, or once servers report one constant value for every entry; later
+    listings that carry it restore trust.
+    """
+
+    # Number of observations before a single repeated value is distrusted
+    CONSTANT_THRESHOLD = 20
+    # Directory entries remembered per signal, and the share of them that
+    # may lack it (the root or a few collections often do) before it is
+    # no longer used
+    WINDOW = 500
+    MISSING_RATIO = 0.5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.missing_props = set()
+        self.compressed = None
+        self.depth_infinity = None
+        self.too_large_paths = set()
+        self._dir_mtimes = set()
+        self._dirs_seen = 0
+        self._etags = set()
+        self._etags_seen = 0
+        self._windows = {"getlastmodified": deque(maxlen=self.WINDOW), "getetag": deque(maxlen=self.WINDOW)}
+        self._misses = dict.fromkeys(self._windows, 0)
+
+    def _record(self, prop, missed):
+        window = self._windows[prop]
+        if len(window) == window.maxlen:
+            self._misses[prop] -= window[0]
+        window.append(missed)
+        self._misses[prop] += missed
+
+    def _mostly_missing(self, prop):
+        n = len(self._windows[prop])
+        return n > 0 and self._misses[prop] > n * self.MISSING_RATIO
+
+    def observe(self, entries, missing=(), encoding=None):
+        """Record one listing.
+
+        entries are Entry records, missing the property names answered
+        with a non-2xx status and encoding the Content-Encoding.
+        """
+        with self._lock:
+            if encoding is not None:
+                self.compressed = encoding.lower() in ("gzip", "deflate", "br")
+            self.missing_props = set(missing)
+            for e in entries:
+                if e.is_dir:
+                    self._record("getlastmodified", not e.mtime)
+                    self._record("getetag", not e.tag)
+                if e.is_dir and e.mtime:
+                    self._dirs_seen += 1
+                    if len(self._dir_mtimes) < 2:
+                        self._dir_mtimes.add(e.mtime)
+                if e.tag:
+                    self._etags_seen += 1
+                    if len(self._etags) < 2:
+                        self._etags.add(e.tag)
+
+    @property
+    def mtime_trusted(self):
+        if self._mostly_missing("getlastmodified"):
+            return False
+        return not (self._dirs_seen >= self.CONSTANT_THRESHOLD and len(self._dir_mtimes) == 1)
+
+    @property
+    def etag_trusted(self):
+        if self._mostly_missing("getetag") or not self._etags_seen:
+            return False
+        return not (self._etags_seen >= self.CONSTANT_THRESHOLD and len(self._etags) == 1)
+
+    def as_dict(self):
+        return {
+            "missing_props": sorted(self.missing_props),
+            "compressed": self.compressed,
+            "depth_infinity": self.depth_infinity,
+            "mtime_trusted": self.mtime_trusted,
+            "etag_trusted": self.etag_trusted,
+        }
@@ -0,0 +1,100 @@
+import concurrent.futures
+import logging
+import posixpath
+import threading
+from backend.services import AlistService
+from backend.sessions import session_registry
+from backend.concurrency import budget_for
+
+logger = logging.getLogger("refresh")
+
+# Refresh requests in flight per run
+REFRESH_WORKERS = 8
+# Failed paths kept on the run record
+MAX_FAILED_PATHS = 100
+
+
+def normalize_path(path):
+    """Canonical form of a destination path: one leading slash, no trailing or doubled slashes."""
+    path = posixpath.normpath('/' + (path or '').strip())
+    # normpath keeps a leading '//' (POSIX allows it to be special)
+    return '/' + path.lstrip('/')
+
+
+def map_to_destination(src_dir, src_base, dst_base):
+    """Destination directory corresponding to a changed source directory."""
+    src_base = src_base.rstrip('/')
+    dst_base = dst_base.rstrip('/')
+    rel_path = ""
+    if src_dir.startswith(src_base):
+        rel_path = src_dir[len(src_base):]
+    else:
+        idx = src_dir.find(src_base)
+        if idx != -1:
+            rel_path = src_dir[idx + len(src_base):]
+    return dst_base + rel_path
+
+
+class RefreshDispatcher:
+    """Refreshes destination Alist directories in the background during a scan.
+
+    submit() maps a changed source directory to its normalized destination
+    path and, unless that path was already submitted, hands it to a pool of
+    REFRESH_WORKERS threads using the account's pooled session. The account's
+    AlistToken is only asked for a token by the first refresh, so runs
+    without changes never touch the destination. Each refresh takes a slot
+    of the destination host's shared budget. close() waits for
+    outstanding refreshes and may be called more than once; summary()
+    reports what succeeded and failed.
+    """
+
+    def __init__(self, auth, src_base, dst_base, workers=REFRESH_WORKERS):
+        self.auth = auth
+        self.src_base = src_base
+        self.dst_base = dst_base
+        self.succeeded = []
+        self.failed = []
+        self._submitted = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.lease = budget_for(auth.url).lease()
+
+        self.session = session_registry.acquire(auth.url, auth.username)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dst-refresh")
+
+    def submit(self, src_dir):
+        refresh_path = normalize_path(map_to_destination(src_dir, self.src_base, self.dst_base))
+        if refresh_path in self._submitted:
+            return
+        self._submitted.add(refresh_path)
+        self._executor.submit(self._refresh, refresh_path)
+
+    def _refresh(self, refresh_path):
+        ok = False
+        try:
+            if not self.auth.get():
+                logger.error(f"No Alist token for destination, cannot refresh {refresh_path}")
+            else:
+                with self.lease.slot():
+                    ok = AlistService.refresh_path(self.auth, refresh_path, session=self.session)
+        except Exception as e:
+            logger.error(f"Failed to refresh Alist path {refresh_path}: {e}")
+        with self._lock:
+            (self.succeeded if ok else self.failed).append(refresh_path)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown(wait=True)
+        session_registry.release(self.session)
+        self.lease.close()
+
+    def summary(self):
+        """Counts plus the (sorted, capped) list of destination paths that failed."""
+        with self._lock:
+            return {
+                "refreshed": len(self.succeeded),
+                "failed": len(self.failed),
+                "failed_paths": sorted(self.failed)[:MAX_FAILED_PATHS],
+            }
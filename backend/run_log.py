@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional
+from backend.models import MonitorTask, TaskRunRecord, read_config, edit_config
+from backend.state_store import STATE_DIR
+
+logger = logging.getLogger("run-log")
+
+# Runs kept per task; older ones are dropped as new ones are appended
+RUNS_PER_TASK = 200
+
+
+def get_run_log_path():
+    return os.path.join(STATE_DIR, "runs.db")
+
+
+class RunLog:
+    """Append-only history of task runs in SQLite (WAL).
+
+    Each run is one row: the TaskRunRecord as JSON plus the task id and start
+    time, indexed together so a task's history or a time range is a range
+    scan. Retention is per task (RUNS_PER_TASK), so a busy task cannot push
+    the other tasks' history out. Records still kept in config.json from
+    older versions are imported the first time the log is opened.
+
+    A run's crawl profile (CrawlProfile.as_dict()) is kept in its own column,
+    so history listings do not carry it; profile() reads it back.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_run_log_path()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY AUTOINCREMENT, task_id TEXT NOT NULL, "
+                             "start_time TEXT NOT NULL, status TEXT NOT NULL, record TEXT NOT NULL)")
+                conn.execute("CREATE INDEX IF NOT EXISTS runs_task_time ON runs (task_id, start_time)")
+                conn.execute("CREATE INDEX IF NOT EXISTS runs_time ON runs (start_time)")
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+                if "profile" not in columns:
+                    conn.execute("ALTER TABLE runs ADD COLUMN profile TEXT")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _record(row):
+        record = json.loads(row[1])
+        record["id"] = row[0]
+        return record
+
+    def _insert(self, conn, record: TaskRunRecord, profile=None):
+        cur = conn.execute("INSERT INTO runs (task_id, start_time, status, record, profile) VALUES (?, ?, ?, ?, ?)",
+                           (record.task_id, record.start_time, record.status, record.model_dump_json(),
+                            json.dumps(profile) if profile is not None else None))
+        return cur.lastrowid
+
+    def _prune(self, conn, task_id):
+        conn.execute("DELETE FROM runs WHERE task_id = ? AND id <= "
+                     "(SELECT id FROM runs WHERE task_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                     (task_id, task_id, RUNS_PER_TASK))
+
+    def append(self, record: TaskRunRecord, profile: Optional[dict] = None) -> int:
+        """Store a finished run and its crawl profile; returns its id."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    run_id = self._insert(conn, record, profile)
+                    self._prune(conn, record.task_id)
+                return run_id
+            finally:
+                conn.close()
+
+    def import_records(self, records):
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    for record in records:
+                        self._insert(conn, record)
+                    for task_id in {r.task_id for r in records}:
+                        self._prune(conn, task_id)
+            finally:
+                conn.close()
+
+    def query(self, task_id: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None, limit: Optional[int] = None):
+        """Runs (record dicts with their "id"), oldest first; limit keeps the newest ones."""
+        where, args = [], []
+        if task_id is not None:
+            where.append("task_id = ?")
+            args.append(task_id)
+        if since:
+            where.append("start_time >= ?")
+            args.append(since)
+        if until:
+            where.append("start_time < ?")
+            args.append(until)
+        sql = "SELECT id, record FROM runs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY start_time DESC, id DESC"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(limit)
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, args).fetchall()
+        finally:
+            conn.close()
+        return [self._record(r) for r in reversed(rows)]
+
+    def get(self, task_id: str, run_id: int):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT id, record FROM runs WHERE id = ? AND task_id = ?", (run_id, task_id)).fetchone()
+        finally:
+            conn.close()
+        return self._record(row) if row else None
+
+    def profile(self, task_id: str, run_id: int):
+        """Crawl profile of a run, or None if the run is unknown or has none."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT profile FROM runs WHERE id = ? AND task_id = ?", (run_id, task_id)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def latest(self):
+        """Most recent run of every task: task_id -> record dict."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT id, record FROM runs WHERE id IN (SELECT MAX(id) FROM runs GROUP BY task_id)").fetchall()
+        finally:
+            conn.close()
+        return {r["task_id"]: r for r in map(self._record, rows)}
+
+    def delete_task(self, task_id: str):
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM runs WHERE task_id = ?", (task_id,))
+            finally:
+                conn.close()
+
+
+class TaskRuntime:
+    """Status and last run time of each task, kept in memory.
+
+    These change on every run, so they are no longer written to
+    config.json; after a restart they are rebuilt from the last run of each
+    task in the run log.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, dict] = {}
+
+    def seed(self, latest, tasks):
+        """Start from each task's last logged run, or from what config.json still holds."""
+        with self._lock:
+            for task_id, record in latest.items():
+                status = "idle" if record.get("status") == "success" else f"error: {record.get('error_message', '')}"
+                self._state.setdefault(task_id, {"status": status, "last_run": record.get("end_time")})
+            for task in tasks:
+                if task.id not in self._state and task.last_run:
+                    self._state[task.id] = {"status": "idle", "last_run": task.last_run}
+
+    def update(self, task_id: str, **fields):
+        with self._lock:
+            self._state.setdefault(task_id, {}).update(fields)
+
+    def get(self, task_id: str) -> dict:
+        with self._lock:
+            return dict(self._state.get(task_id, {}))
+
+    def apply(self, task: MonitorTask) -> MonitorTask:
+        """Copy of task with its runtime status and last_run filled in."""
+        fields = self.get(task.id)
+        return task.model_copy(update=fields) if fields else task
+
+    def forget(self, task_id: str):
+        with self._lock:
+            self._state.pop(task_id, None)
+
+
+_run_log: Optional[RunLog] = None
+_run_log_lock = threading.Lock()
+task_runtime = TaskRuntime()
+
+
+def get_run_log() -> RunLog:
+    """The process-wide run log, opened (and migrated) on first use."""
+    global _run_log
+    with _run_log_lock:
+        if _run_log is None:
+            run_log = RunLog()
+            legacy = read_config().task_history
+            if legacy:
+                run_log.import_records(list(legacy))
+                with edit_config() as config:
+                    config.task_history = []
+                logger.info(f"Moved {len(legacy)} run records from config.json to {run_log.path}.")
+            task_runtime.seed(run_log.latest(), read_config().tasks)
+            _run_log = run_log
+        return _run_log
@@ -0,0 +1,78 @@
+import logging
+import os
+from backend.path_index import get_parent_path
+
+logger = logging.getLogger("scheduler")
+
+
+class ScanDiff:
+    """Diff of a running scan against the stored state.
+
+    The scanners hand every finished directory listing to add() while the
+    crawl is still going, so new and modified entries are known (and their
+    parent directory reported to on_changed_dir) as soon as that directory
+    has been listed. Deletions can only be told apart from "not listed yet"
+    once the scan is complete, which is what finish() is for.
+    """
+
+    def __init__(self, old_state, on_changed_dir=None):
+        self.old_state = old_state
+        self.on_changed_dir = on_changed_dir
+        self.changed_dirs = set()
+        self.new_files = 0
+        self.modified_files = 0
+        self.deleted_files = 0
+        # Rows to write back: only entries that differ from the stored state
+        self.upserts = {}
+        self.deletes = []
+
+    def _changed(self, href):
+        parent = get_parent_path(href)
+        if parent not in self.changed_dirs:
+            self.changed_dirs.add(parent)
+            if self.on_changed_dir:
+                self.on_changed_dir(parent)
+
+    def add(self, results):
+        """Diff one listing (path -> Entry). Entries seen twice count once."""
+        for href, info in results.items():
+            if href in self.upserts:
+                continue
+            old = self.old_state.get(href)
+            if old is None:
+                self.upserts[href] = info
+                if info.is_dir:
+                    logger.info(f"Change detected: [New Dir] {href}")
+                else:
+                    logger.info(f"Change detected: [New File] {href}")
+                    self.new_files += 1
+                self._changed(href)
+            elif old != info:
+                self.upserts[href] = info
+                if not info.is_dir:
+                    logger.info(f"Change detected: [Modified File] {href}")
+                    self.modified_files += 1
+                    self._changed(href)
+
+    def finish(self, new_state, is_local=False):
+        """Detect deletions once the scan is complete.
+
+        For local scans an entry missing from new_state is checked on disk
+        again and kept when it still exists.
+        """
+        for href, info in self.old_state.items():
+            if href in new_state:
+                continue
+
+            # Double check if local file really deleted
+            if is_local and os.path.exists(href):
+                new_state[href] = info
+                continue
+
+            self.deletes.append(href)
+            if info.is_dir:
+                logger.info(f"Change detected: [Deleted Dir] {href}")
+            else:
+                logger.info(f"Change detected: [Deleted File] {href}")
+                self.deleted_files += 1
+            self._changed(href)
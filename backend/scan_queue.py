@@ -1,70 +1,202 @@
+import os
 import time
 import logging
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from dataclasses import dataclass, field
 import threading
-from collections import deque
+import heapq
+import itertools
+from backend.path_index import get_parent_path
+from backend import metrics
 
 logger = logging.getLogger("scan_queue")
 
+# Watcher events of one directory are held until it has been quiet this long...
+EVENT_QUIET_SECONDS = float(os.getenv("EVENT_QUIET_SECONDS", "3"))
+# ...but never longer than this after the first one
+EVENT_MAX_DELAY_SECONDS = float(os.getenv("EVENT_MAX_DELAY_SECONDS", "30"))
+
+# Lower runs first
+PRIORITY_MANUAL = 0
+PRIORITY_EVENT = 1
+PRIORITY_SCHEDULED = 2
+
+@dataclass
+class WatchEvent:
+    event_type: str  # created, modified, deleted or moved
+    path: str
+    dest_path: str = ""  # moved: where the entry went
+    is_directory: bool = False
+
 @dataclass
 class ScanJob:
     task_id: str
-    path: str  # Source path (local or remote)
-    job_type: str  # "FULL" or "PARTIAL"
+    path: str  # Source path (local or remote); the directory for EVENTS jobs
+    job_type: str  # "FULL", "PARTIAL" or "EVENTS" (coalesced watcher events)
+    priority: int = PRIORITY_SCHEDULED
+    events: List[WatchEvent] = field(default_factory=list)
+    folded: int = 0  # raw watcher events merged into this job
     created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    queued_at: float = 0.0  # when it entered the priority queue
 
 class ScanQueue:
+    """Priority queue of scan jobs, drained by a pool of worker threads.
+
+    Jobs run by priority (manual runs, then watcher events, then scheduled
+    scans) and in arrival order within one priority. Jobs of one task never
+    run at the same time: get_job() passes over a task's jobs while another
+    of its jobs is running, until the worker calls task_done(). A job that
+    is already queued is not queued twice, a second request can only raise
+    its priority. Workers block on a condition variable, so a new job is
+    picked up at once.
+
+    Watcher events go through a trailing-edge coalescing stage first: events
+    of one task and parent directory are merged into a single pending EVENTS
+    job, keeping only the last event per path. The job is queued once the
+    directory has been quiet for quiet_seconds, or max_delay_seconds after
+    its first event when the burst does not stop.
+    """
     _instance = None
     _lock = threading.Lock()
     
-    def __init__(self):
-        self.queue = deque()
-        self.pending_tasks: Dict[str, float] = {}  # key -> timestamp
+    def __init__(self, quiet_seconds: float = EVENT_QUIET_SECONDS, max_delay_seconds: float = EVENT_MAX_DELAY_SECONDS):
+        self.heap: List[Tuple[int, int, ScanJob]] = []
+        self._seq = itertools.count()
+        self.queued: Dict[str, ScanJob] = {}  # key -> job waiting in the heap
+        self.running: Dict[str, ScanJob] = {}  # task_id -> job being processed
+        # (task_id, parent dir) -> EVENTS job still collecting events
+        self.coalescing: Dict[Tuple[str, str], ScanJob] = {}
+        self.quiet_seconds = quiet_seconds
+        self.max_delay_seconds = max_delay_seconds
         self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
         
     @classmethod
     def get_instance(cls):
         with cls._lock:
             if cls._instance is None:
                 cls._instance = ScanQueue()
+                metrics.track_queue(cls._instance)
         return cls._instance
 
-    def add_job(self, task_id: str, path: str, job_type: str = "PARTIAL"):
+    @staticmethod
+    def _key(job: ScanJob):
+        return f"{job.task_id}:{job.path}:{job.job_type}"
+
+    def _push(self, job: ScanJob):
+        job.queued_at = time.time()
+        heapq.heappush(self.heap, (job.priority, next(self._seq), job))
+        self.cond.notify()
+
+    def add_event(self, task_id: str, event: WatchEvent):
+        """Fold a watcher event into the pending job of its directory."""
+        group = (task_id, get_parent_path(event.path))
+        now = time.time()
+        with self.cond:
+            job = self.coalescing.get(group)
+            if job is None:
+                job = ScanJob(task_id=task_id, path=group[1], job_type="EVENTS", priority=PRIORITY_EVENT)
+                self.coalescing[group] = job
+                # A waiting worker has to pick up the new flush deadline
+                self.cond.notify()
+            # Last event per path wins; the file is stat'ed when the job runs
+            key = (event.path, event.dest_path)
+            job.events = [e for e in job.events if (e.path, e.dest_path) != key]
+            job.events.append(event)
+            job.folded += 1
+            job.updated_at = now
+
+    def _flush_ready(self, now: float):
+        """Queue coalesced jobs that are due; returns seconds until the next one is."""
+        next_due = None
+        for group, job in list(self.coalescing.items()):
+            due = min(job.updated_at + self.quiet_seconds, job.created_at + self.max_delay_seconds)
+            if due <= now:
+                del self.coalescing[group]
+                self._push(job)
+                logger.info(f"Queue Added: [EVENTS] {job.task_id} - {job.path} ({len(job.events)} paths from {job.folded} events, Queue Size: {len(self.heap)})")
+            elif next_due is None or due - now < next_due:
+                next_due = due - now
+        return next_due
+
+    def add_job(self, task_id: str, path: str, job_type: str = "PARTIAL", priority: int = PRIORITY_SCHEDULED):
         """
-        Add a job to the queue with debounce logic.
-        key: task_id + path
+        Add a job to the queue unless the same job is already waiting.
+        key: task_id + path + job_type
         """
-        key = f"{task_id}:{path}:{job_type}"
-        now = time.time()
+        job = ScanJob(task_id=task_id, path=path, job_type=job_type, priority=priority)
+        key = self._key(job)
         
-        with self.lock:
-            # Simple Debounce: If same job added within 2 seconds, ignore
-            if key in self.pending_tasks:
-                last_time = self.pending_tasks[key]
-                if now - last_time < 2.0:
-                    # logger.debug(f"Debounced job: {key}")
-                    return
+        with self.cond:
+            queued = self.queued.get(key)
+            if queued is not None:
+                if priority < queued.priority:
+                    queued.priority = priority
+                    self.heap = [(j.priority, seq, j) for _, seq, j in self.heap]
+                    heapq.heapify(self.heap)
+                    logger.info(f"Queue Raised: [{job_type}] {task_id} - {path} to priority {priority}")
+                return
             
-            self.pending_tasks[key] = now
-            job = ScanJob(task_id=task_id, path=path, job_type=job_type)
-            self.queue.append(job)
-            logger.info(f"Queue Added: [{job_type}] {task_id} - {path} (Queue Size: {len(self.queue)})")
+            self.queued[key] = job
+            self._push(job)
+            logger.info(f"Queue Added: [{job_type}] {task_id} - {path} (Priority: {priority}, Queue Size: {len(self.heap)})")
 
-    def pop_job(self) -> Optional[ScanJob]:
-        with self.lock:
-            if not self.queue:
-                return None
-            
-            job = self.queue.popleft()
-            
-            # Clean up pending_tasks (lazy cleanup)
-            key = f"{job.task_id}:{job.path}:{job.job_type}"
-            if key in self.pending_tasks:
-                del self.pending_tasks[key]
-                
-            return job
+    def _take_runnable(self) -> Optional[ScanJob]:
+        """Pop the best job whose task is not running, leaving the others queued."""
+        skipped = []
+        job = None
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if entry[2].task_id in self.running:
+                skipped.append(entry)
+                continue
+            job = entry[2]
+            break
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        if job is not None:
+            self.queued.pop(self._key(job), None)
+            self.running[job.task_id] = job
+            metrics.observe_queue_wait(job.job_type, time.time() - job.queued_at)
+        return job
+
+    def get_job(self, timeout: Optional[float] = None) -> Optional[ScanJob]:
+        """Block until a job can run (or timeout passes, then None).
+
+        The caller must hand the job back with task_done().
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                wait = self._flush_ready(time.time()) if self.coalescing else None
+                job = self._take_runnable()
+                if job is not None:
+                    return job
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.cond.wait(wait)
+
+    def task_done(self, job: ScanJob):
+        """Mark a job returned by get_job() finished, letting its task's next job run."""
+        with self.cond:
+            if self.running.get(job.task_id) is job:
+                del self.running[job.task_id]
+            # Jobs of this task may have been passed over while it ran
+            self.cond.notify_all()
 
     def size(self):
         with self.lock:
-            return len(self.queue)
+            return len(self.heap)
+
+    def running_count(self):
+        with self.lock:
+            return len(self.running)
+
+    def coalescing_size(self):
+        """Directories with watcher events still waiting for their quiet period."""
+        with self.lock:
+            return len(self.coalescing)
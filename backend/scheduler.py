@@ -1,53 +1,57 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from backend.models import load_config, save_config, MonitorTask, TaskRunRecord
+from backend.models import read_config, edit_config, MonitorTask, TaskRunRecord
 from backend.services import WebDAVService, AlistService
 import logging
-import json
 import os
 import datetime
 import time
 from datetime import timedelta
 from zoneinfo import ZoneInfo
-from typing import Dict, Set
-from backend.scan_queue import ScanQueue, ScanJob
+from typing import Dict
+from backend.scan_queue import ScanQueue, ScanJob, PRIORITY_SCHEDULED
+from backend.state_store import StateStore
+from backend.local_scanner import scan_local
+from backend.scan_diff import ScanDiff
+from backend.run_log import get_run_log, task_runtime
+from backend.concurrency import budget_for, current_owner
+from backend import metrics
+from backend.refresh import RefreshDispatcher, normalize_path, map_to_destination
+from backend.path_index import get_parent_path
+from backend.entry import Entry
 import threading
-import gzip
 import traceback
 
 logger = logging.getLogger("scheduler")
 
 scheduler = BackgroundScheduler(timezone="Asia/Shanghai")
-running_tasks: Set[str] = set()
 retry_counts: Dict[str, int] = {}
-MAX_HISTORY = 200
+# Threads draining the scan queue; jobs of one task never run concurrently
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "3"))
 
-def get_state_path(task_id: str):
-    return f"data/state_{task_id}.json.gz"
+def _update_task(task_id: str, **fields):
+    """Set fields on the stored task, unless it was deleted meanwhile."""
+    with edit_config() as config:
+        stored = next((t for t in config.tasks if t.id == task_id), None)
+        if stored:
+            for name, value in fields.items():
+                setattr(stored, name, value)
 
-def get_legacy_state_path(task_id: str):
-    return f"data/state_{task_id}.json"
-
-def get_parent_path(file_href: str) -> str:
-    parts = file_href.rstrip('/').split('/')
-    if len(parts) <= 1:
-        return "/"
-    return "/".join(parts[:-1])
+def _profile(scan_stats):
+    profile = scan_stats.get('profile')
+    return profile.as_dict() if profile is not None else None
 
 def run_task(task_id: str):
-    config = load_config()
+    config = read_config()
     task = next((t for t in config.tasks if t.id == task_id), None)
     if not task:
         return
+    # The run works on its own copy; config changes go through _update_task
+    task = task.model_copy()
     if not task.enabled:
         logger.info(f"Task {task_id} ({task.name}) is disabled, skipping.")
         return
 
-    if task_id in running_tasks:
-        logger.warning(f"Task {task_id} is already running. Skipping this trigger.")
-        return
-    
-    running_tasks.add(task_id)
     start_time = time.time()
     start_iso = datetime.datetime.now(ZoneInfo("Asia/Shanghai")).isoformat()
     run_new_files = 0
@@ -55,88 +59,64 @@ def run_task(task_id: str):
     run_deleted = 0
     run_scanned = 0
     run_dirs_refreshed = 0
+    refresh_summary = {}
+    scan_stats = {}
+    refresher = None
+    # Host budget leases taken during this run are accounted to the task
+    owner_token = current_owner.set(task.name)
     try:
         logger.info(f"Running task: {task.name}")
-        task.status = "running"
-        save_config(config)
+        task_runtime.update(task_id, status="running")
 
         is_local = getattr(task, 'src_type', 'webdav') == 'local'
 
         src_acc = None
         dst_acc = next((a for a in config.accounts if a.id == task.dst_account_id), None)
+        if dst_acc:
+            budget_for(dst_acc.url, dst_acc.max_in_flight, dst_acc.max_rps)
 
         if not is_local:
             src_acc = next((a for a in config.accounts if a.id == task.src_account_id), None)
             if not src_acc:
-                task.enabled = False
-                task.status = "error: Scanning account missing (disabled)"
-                save_config(config)
+                _update_task(task_id, enabled=False)
+                task_runtime.update(task_id, status="error: Scanning account missing (disabled)")
                 if scheduler.get_job(task_id):
                     scheduler.remove_job(task_id)
                 raise Exception("Scanning account not found. Task has been disabled.")
+            budget_for(src_acc.url, src_acc.max_in_flight, src_acc.max_rps)
 
-        state_path = get_state_path(task_id)
-        legacy_path = get_legacy_state_path(task_id)
-        old_state = {}
-        
-        if os.path.exists(state_path):
-            try:
-                with gzip.open(state_path, "rt", encoding="utf-8") as f:
-                    old_state = json.load(f)
-                logger.info(f"Loaded previous state (compressed) with {len(old_state)} items.")
-            except Exception as e:
-                logger.warning(f"Failed to load compressed state: {e}, starting fresh.")
-        elif os.path.exists(legacy_path):
-            try:
-                with open(legacy_path, "r", encoding="utf-8") as f:
-                    old_state = json.load(f)
-                logger.info(f"Loaded legacy state with {len(old_state)} items. Will migrate to compressed format.")
-            except Exception as e:
-                logger.warning(f"Failed to load legacy state: {e}, starting fresh.")
+        store = StateStore(task_id)
+        try:
+            old_state = store.load()
+        except Exception as e:
+            logger.warning(f"Failed to load state: {e}, starting fresh.")
+            old_state = {}
+        if old_state:
+            logger.info(f"Loaded previous state with {len(old_state)} items.")
         else:
             logger.info("No previous state found, starting fresh scan.")
 
+        if dst_acc and dst_acc.type == "alist":
+            if getattr(task, 'refresh_destination', True):
+                dst_auth = AlistService.get_auth(dst_acc.url, dst_acc.username, dst_acc.password, dst_acc.token)
+                refresher = RefreshDispatcher(dst_auth, task.src_path, task.dst_path)
+            else:
+                logger.info(f"Skipping Alist refresh for task {task.name} (refresh_destination=False).")
+
+        # Listings are diffed as the scanners produce them, so changed
+        # directories get refreshed while the crawl is still running
+        diff = ScanDiff(old_state, on_changed_dir=refresher.submit if refresher else None)
         scan_error = None
         new_state = {}
 
         if is_local:
             local_path = task.src_path.rstrip('/')
-            logger.info(f"Scanning local path: {local_path} ...")
             if not os.path.exists(local_path):
                 raise Exception(f"Local path not found: {local_path}")
             try:
-                scanned_count = 0
-                last_log_time = time.time()
-                # Enable followlinks to support symlinked directories in Docker volumes
-                for root, dirs, files in os.walk(local_path, followlinks=True):
-                    scanned_count += 1
-                    current_time = time.time()
-                    if current_time - last_log_time > 10:
-                        logger.info(f"Scanning local path... checked {scanned_count} directories, found {len(new_state)} items so far...")
-                        last_log_time = current_time
-                    
-                    rel_root = root[len(local_path):]
-                    if not rel_root.startswith('/'):
-                        rel_root = '/' + rel_root
-                    dir_key = task.src_path.rstrip('/') + rel_root.rstrip('/')
-                    if dir_key:
-                        new_state[dir_key + '/'] = {'is_dir': True, 'mtime': str(os.path.getmtime(root)), 'size': 0}
-                    
-                    for i, fname in enumerate(files):
-                        fpath = os.path.join(root, fname)
-                        try:
-                            stat = os.stat(fpath)
-                            file_key = dir_key.rstrip('/') + '/' + fname
-                            new_state[file_key] = {
-                                'is_dir': False,
-                                'mtime': str(stat.st_mtime),
-                                'size': stat.st_size
-                            }
-                            if len(new_state) <= 5:
-                                logger.info(f"Found file: {fpath}")
-                        except (PermissionError, OSError):
-                            continue
-                logger.info(f"Local scan found {len(new_state)} items. Scanned {scanned_count} directories.")
+                # The verification slice rotates once per scheduling interval
+                slot = int(time.time() // max(task.interval, 60))
+                new_state = scan_local(local_path, old_state=old_state, smart_scan=task.smart_scan and getattr(task, 'local_mtime_skip', False), verify_percent=getattr(task, 'verify_sample', 0), slot=slot, concurrency=task.concurrency, max_concurrency=getattr(task, 'max_concurrency', 0), stats=scan_stats, on_listing=diff.add)
             except Exception as scan_ex:
                 scan_error = str(scan_ex)
                 new_state = {}
@@ -145,25 +125,24 @@ def run_task(task_id: str):
             logger.info(f"Scanning {src_name}:{task.src_path}...")
             if src_acc.type == "webdav":
                 try:
-                    new_state = WebDAVService.list_recursive(src_acc.url, src_acc.username, src_acc.password, task.src_path, old_state=old_state, smart_scan=task.smart_scan, concurrency=task.concurrency)
+                    new_state = WebDAVService.list_recursive(src_acc.url, src_acc.username, src_acc.password, task.src_path, old_state=old_state, smart_scan=task.smart_scan, concurrency=task.concurrency, depth_infinity=getattr(task, 'depth_infinity', False), engine=getattr(task, 'engine', 'threads'), max_concurrency=getattr(task, 'max_concurrency', 0), stats=scan_stats, on_listing=diff.add)
                 except Exception as scan_ex:
                     scan_error = str(scan_ex)
                     new_state = {}
             elif src_acc.type == "alist":
-                old_token = src_acc.token
-                token = src_acc.token or AlistService.get_token(src_acc.url, src_acc.username, src_acc.password)
-                
-                if not token:
+                auth = AlistService.get_auth(src_acc.url, src_acc.username, src_acc.password, src_acc.token)
+                if not auth.get():
                     raise Exception(f"Cannot get Alist token for account {src_acc.name}")
                 
-                if token and token != old_token:
-                    logger.info(f"Updating cached Alist token for account {src_acc.name}")
-                    src_acc.token = token
-                    save_config(config)
-                
                 refresh = getattr(task, 'refresh_source', False)
+                crawl_args = dict(concurrency=task.concurrency, engine=getattr(task, 'engine', 'threads'), max_concurrency=getattr(task, 'max_concurrency', 0), per_page=src_acc.per_page)
                 try:
-                    new_state = AlistService.list_recursive_rich(src_acc.url, token, task.src_path, old_state=old_state, refresh=refresh, smart_scan=task.smart_scan, concurrency=task.concurrency)
+                    if refresh and getattr(task, 'refresh_mode', 'full') == 'changed':
+                        # The sample rotates once per scheduling interval
+                        slot = int(time.time() // max(task.interval, 60))
+                        new_state = AlistService.list_recursive_changed(auth, task.src_path, old_state=old_state, smart_scan=task.smart_scan, sample_percent=getattr(task, 'refresh_sample', 5), sample_slot=slot, stats=scan_stats, on_listing=diff.add, **crawl_args)
+                    else:
+                        new_state = AlistService.list_recursive_rich(auth, task.src_path, old_state=old_state, refresh=refresh, smart_scan=task.smart_scan, stats=scan_stats, on_listing=diff.add, **crawl_args)
                 except Exception as scan_ex:
                     scan_error = str(scan_ex)
                     new_state = {}
@@ -177,100 +156,32 @@ def run_task(task_id: str):
         
         logger.info(f"Scan completed. Found {len(new_state)} items (Files + Dirs).")
 
-        changed_dirs: Set[str] = set()
-        new_files = 0
-        modified_files = 0
-        deleted_files = 0
-        
-        for href, info in new_state.items():
-            is_dir = info.get('is_dir', False)
-            
-            if href not in old_state:
-                if is_dir:
-                    logger.info(f"Change detected: [New Dir] {href}")
-                    changed_dirs.add(get_parent_path(href))
-                else:
-                    logger.info(f"Change detected: [New File] {href}")
-                    changed_dirs.add(get_parent_path(href))
-                    new_files += 1
-            elif old_state[href] != info:
-                if not is_dir:
-                    logger.info(f"Change detected: [Modified File] {href}")
-                    changed_dirs.add(get_parent_path(href))
-                    modified_files += 1
-                
-        for href, info_or_dict in old_state.items():
-            if href not in new_state:
-                is_dir = False
-                if isinstance(info_or_dict, dict):
-                    is_dir = info_or_dict.get('is_dir', False)
-                
-                # Double check if local file really deleted
-                if is_local and os.path.exists(href):
-                    new_state[href] = info_or_dict
-                    continue
-
-                if is_dir:
-                    logger.info(f"Change detected: [Deleted Dir] {href}")
-                else:
-                    logger.info(f"Change detected: [Deleted File] {href}")
-                    deleted_files += 1
-                
-                changed_dirs.add(get_parent_path(href))
-
-        if changed_dirs:
-            logger.info(f"Action: Refreshing {len(changed_dirs)} target directories due to changes.")
-            
-            if dst_acc and dst_acc.type == "alist":
-                dst_old_token = dst_acc.token
-                dst_token = dst_acc.token or AlistService.get_token(dst_acc.url, dst_acc.username, dst_acc.password)
-                if dst_token:
-                    if dst_token != dst_old_token:
-                        dst_acc.token = dst_token
-                        save_config(config)
-                    
-                    refresh_dst = getattr(task, 'refresh_destination', True)
-                    if refresh_dst:
-                        base_src_path = task.src_path.rstrip('/')
-                        base_dst_path = task.dst_path.rstrip('/')
-                        
-                        for src_dir in changed_dirs:
-                            rel_path = ""
-                            if src_dir.startswith(base_src_path):
-                                rel_path = src_dir[len(base_src_path):]
-                            else:
-                                idx = src_dir.find(base_src_path)
-                                if idx != -1:
-                                    rel_path = src_dir[idx + len(base_src_path):]
-                            
-                            refresh_path = base_dst_path + rel_path
-                            try:
-                                AlistService.refresh_path(dst_acc.url, dst_token, refresh_path)
-                            except Exception as e:
-                                logger.error(f"Failed to refresh Alist path {refresh_path}: {e}")
-                    else:
-                        logger.info(f"Skipping Alist refresh for task {task.name} (refresh_destination=False).")
-        
+        # Deletions are only certain now that the whole tree has been listed
+        diff.finish(new_state, is_local)
+        changed_dirs = diff.changed_dirs
+        new_files, modified_files, deleted_files = diff.new_files, diff.modified_files, diff.deleted_files
+        if refresher:
+            if changed_dirs:
+                logger.info(f"Action: Waiting for {len(changed_dirs)} target directory refreshes to finish.")
+            refresher.close()
+            refresh_summary = refresher.summary()
+            if refresh_summary['failed']:
+                logger.warning(f"{refresh_summary['failed']} of {refresh_summary['refreshed'] + refresh_summary['failed']} target directory refreshes failed.")
         
         try:
-            with gzip.open(state_path, "wt", encoding="utf-8") as f:
-                json.dump(new_state, f)
-            
-            
-            if os.path.exists(legacy_path):
-                os.remove(legacy_path)
-                logger.info(f"Migrated legacy state file to compressed format for task {task_id}")
+            store.apply(diff.upserts, diff.deletes)
+            if diff.upserts or diff.deletes:
+                logger.info(f"State updated: {len(diff.upserts)} changed, {len(diff.deletes)} removed.")
         except Exception as e:
-            logger.error(f"Failed to save state file: {e}")
+            logger.error(f"Failed to save state: {e}")
         
         run_new_files = new_files
         run_modified = modified_files
         run_deleted = deleted_files
         run_scanned = len(new_state)
-        run_dirs_refreshed = len(changed_dirs)
+        run_dirs_refreshed = refresh_summary['refreshed'] if refresher else len(changed_dirs)
 
-        task.last_run = datetime.datetime.now(ZoneInfo("Asia/Shanghai")).isoformat()
-        task.status = "idle"
+        task_runtime.update(task_id, last_run=datetime.datetime.now(ZoneInfo("Asia/Shanghai")).isoformat(), status="idle")
         retry_counts.pop(task_id, None)
         try:
             from backend.main import add_notification
@@ -292,15 +203,20 @@ def run_task(task_id: str):
             duration_seconds=round(time.time() - start_time, 2),
             status="success", items_scanned=run_scanned,
             new_files=run_new_files, modified_files=run_modified,
-            deleted_files=run_deleted, dirs_refreshed=run_dirs_refreshed
+            deleted_files=run_deleted, dirs_refreshed=run_dirs_refreshed,
+            refresh_failed=refresh_summary.get('failed', 0), refresh_failed_paths=refresh_summary.get('failed_paths', []),
+            concurrency=scan_stats.get('concurrency', 0), throttled=scan_stats.get('throttled', 0)
         )
-        config.task_history.append(record)
-        if len(config.task_history) > MAX_HISTORY:
-            config.task_history = config.task_history[-MAX_HISTORY:]
+        get_run_log().append(record, _profile(scan_stats))
+        metrics.observe_run(task.name, record.status, time.time() - start_time, scan_stats, run_scanned, run_new_files, run_modified, run_deleted)
 
     except Exception as e:
         logger.error(f"Task {task_id} failed: {e}")
-        task.status = f"error: {str(e)}"
+        task_runtime.update(task_id, status=f"error: {str(e)}")
+        if refresher:
+            refresher.close()
+            refresh_summary = refresher.summary()
+            run_dirs_refreshed = refresh_summary['refreshed']
 
         record = TaskRunRecord(
             task_id=task_id, task_name=task.name,
@@ -310,11 +226,12 @@ def run_task(task_id: str):
             status="error", error_message=str(e),
             items_scanned=run_scanned,
             new_files=run_new_files, modified_files=run_modified,
-            deleted_files=run_deleted, dirs_refreshed=run_dirs_refreshed
+            deleted_files=run_deleted, dirs_refreshed=run_dirs_refreshed,
+            refresh_failed=refresh_summary.get('failed', 0), refresh_failed_paths=refresh_summary.get('failed_paths', []),
+            concurrency=scan_stats.get('concurrency', 0), throttled=scan_stats.get('throttled', 0)
         )
-        config.task_history.append(record)
-        if len(config.task_history) > MAX_HISTORY:
-            config.task_history = config.task_history[-MAX_HISTORY:]
+        get_run_log().append(record, _profile(scan_stats))
+        metrics.observe_run(task.name, record.status, time.time() - start_time, scan_stats, run_scanned, run_new_files, run_modified, run_deleted)
 
         max_r = getattr(task, 'max_retries', 0)
         if max_r > 0:
@@ -324,7 +241,7 @@ def run_task(task_id: str):
                 delay = getattr(task, 'retry_delay', 60)
                 logger.warning(f"Retrying task {task.name} ({count+1}/{max_r}) in {delay}s")
                 scheduler.add_job(
-                    run_task, 'date',
+                    queue_task, 'date',
                     run_date=datetime.datetime.now() + timedelta(seconds=delay),
                     args=[task_id], id=f"{task_id}_retry",
                     replace_existing=True
@@ -338,22 +255,105 @@ def run_task(task_id: str):
             add_notification(f"任务失败: {task.name}", str(e), "error")
         except: pass
     finally:
-        running_tasks.discard(task_id)
-        save_config(config)
+        if refresher:
+            refresher.close()
+        current_owner.reset(owner_token)
+
+def _stat_entries(path, is_directory):
+    """Current entries at a local path: the whole subtree for a directory."""
+    if is_directory:
+        return scan_local(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return {}
+    return {path: Entry(False, st.st_size, st.st_mtime)}
+
+
+def _removed_keys(store, path):
+    """Stored keys of a directory and everything below it."""
+    return [path + '/'] + list(store.subtree(path))
+
+
+def apply_watch_events(job: ScanJob):
+    """Patch the task's stored state with a job's coalesced watcher events and refresh the affected directories.
+
+    Only the entries the events name are written, the parent directories'
+    own rows are left alone so the next smart scan still relists them.
+    Returns the source directories that changed.
+    """
+    config = read_config()
+    task = next((t for t in config.tasks if t.id == job.task_id), None)
+    if not task:
+        return []
+
+    store = StateStore(task.id)
+    upserts = {}
+    deletes = set()
+    changed_dirs = set()
+
+    def remove(path, is_directory):
+        keys = _removed_keys(store, path) if is_directory else [path]
+        if is_directory:
+            # Including entries an earlier event of this job added
+            keys += [k for k in upserts if k.startswith(path + '/')]
+        for k in keys:
+            upserts.pop(k, None)
+        deletes.update(keys)
+
+    def add(path, is_directory):
+        entries = _stat_entries(path, is_directory)
+        upserts.update(entries)
+        deletes.difference_update(entries)
+
+    # Events are in arrival order, so a later event on a path wins
+    for event in job.events:
+        changed_dirs.add(get_parent_path(event.path))
+        if event.event_type in ("created", "modified"):
+            add(event.path, event.is_directory)
+        elif event.event_type == "deleted":
+            remove(event.path, event.is_directory)
+        elif event.event_type == "moved":
+            remove(event.path, event.is_directory)
+            add(event.dest_path, event.is_directory)
+            changed_dirs.add(get_parent_path(event.dest_path))
+    store.apply(upserts, sorted(deletes))
+
+    dst_acc = next((a for a in config.accounts if a.id == task.dst_account_id), None)
+    if dst_acc and dst_acc.type == "alist" and getattr(task, 'refresh_destination', True):
+        auth = AlistService.get_auth(dst_acc.url, dst_acc.username, dst_acc.password, dst_acc.token)
+        lease = budget_for(dst_acc.url, dst_acc.max_in_flight, dst_acc.max_rps).lease(task.name)
+        try:
+            for src_dir in sorted(changed_dirs):
+                refresh_path = normalize_path(map_to_destination(src_dir, task.src_path, task.dst_path))
+                try:
+                    with lease.slot():
+                        ok = AlistService.refresh_path(auth, refresh_path)
+                    if not ok:
+                        logger.warning(f"Alist refresh of {refresh_path} failed after watcher events in {job.path}")
+                except Exception as e:
+                    logger.error(f"Failed to refresh Alist path {refresh_path}: {e}")
+        finally:
+            lease.close()
+    return sorted(changed_dirs)
+
 
 def process_scan_job(job: ScanJob):
     """
     Process a scan job from the queue.
-    Watchdog now only triggers purely local EVENT jobs which are logged directly.
+    Coalesced watchdog EVENTS jobs patch the stored state and refresh only the affected directories.
     """
-    if job.job_type.startswith("EVENT_"):
-        event_name = job.job_type.replace("EVENT_", "").lower()
-        logger.info(f"[实时监控] 侦测到局部变更 | 事件: {event_name} | 路径: {job.path}")
+    if job.job_type == "EVENTS":
+        logger.info(f"[实时监控] 侦测到局部变更 | 目录: {job.path} | 合并事件: {job.folded} | 路径数: {len(job.events)}")
+        try:
+            apply_watch_events(job)
+        except Exception as e:
+            logger.error(f"Failed to apply watch events for {job.path}: {e}")
         
         # Also notify via web UI
         try:
             from backend.main import add_notification
-            add_notification("实时监控反馈", f"文件发生变动 ({event_name}): {job.path}", "info")
+            add_notification("实时监控反馈", f"目录发生变动 ({job.folded} 个事件, {len(job.events)} 个路径): {job.path}", "info")
         except:
             pass
         return
@@ -361,29 +361,39 @@ def process_scan_job(job: ScanJob):
     logger.info(f"Processing scan job for task {job.task_id} (Type: {job.job_type}, Path: {job.path})")
     run_task(job.task_id)
 
+def queue_task(task_id: str, priority: int = PRIORITY_SCHEDULED):
+    """Queue a full run; scheduled, retried and manual runs all go through the scan queue."""
+    ScanQueue.get_instance().add_job(task_id, "", "FULL", priority=priority)
+
 def worker_thread():
     queue = ScanQueue.get_instance()
-    logger.info("Scan Worker Thread Started")
+    logger.info(f"Scan Worker Thread Started ({threading.current_thread().name})")
     while True:
+        job = None
         try:
-            job = queue.pop_job()
-            if job:
-                process_scan_job(job)
-            else:
-                time.sleep(1)
+            job = queue.get_job()
+            process_scan_job(job)
         except Exception as e:
             logger.error(f"Worker Loop Error: {e}")
             logger.error(traceback.format_exc())
-            time.sleep(5)
+            if job is None:
+                # get_job itself failed: don't spin on it
+                time.sleep(1)
+        finally:
+            if job is not None:
+                queue.task_done(job)
 
 def init_scheduler():
+    # Opens the run log (moving old history out of config.json) and restores task status
+    get_run_log()
     scheduler.start()
     
-    # Start Worker Thread
-    t = threading.Thread(target=worker_thread, daemon=True)
-    t.start()
+    # Start Worker Threads
+    for i in range(max(SCAN_WORKERS, 1)):
+        t = threading.Thread(target=worker_thread, name=f"scan-worker-{i}", daemon=True)
+        t.start()
     
-    config = load_config()
+    config = read_config()
     for task in config.tasks:
         if task.enabled:
             update_task_job(task)
@@ -399,7 +409,7 @@ def update_task_job(task: MonitorTask):
             try:
                 trigger = CronTrigger.from_crontab(cron_expr.strip(), timezone='Asia/Shanghai')
                 scheduler.add_job(
-                    run_task, trigger,
+                    queue_task, trigger,
                     id=task.id, args=[task.id],
                     replace_existing=True
                 )
@@ -407,13 +417,13 @@ def update_task_job(task: MonitorTask):
             except Exception as e:
                 logger.error(f"Invalid cron expression '{cron_expr}' for task {task.name}: {e}. Falling back to interval.")
                 scheduler.add_job(
-                    run_task, 'interval',
+                    queue_task, 'interval',
                     seconds=task.interval, id=task.id,
                     args=[task.id], replace_existing=True
                 )
         else:
             scheduler.add_job(
-                run_task, 'interval',
+                queue_task, 'interval',
                 seconds=task.interval, id=task.id,
                 args=[task.id], replace_existing=True
             )
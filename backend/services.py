@@ -1,21 +1,211 @@
 import requests
-import xmltodict
 import logging
 import json
+import base64
 import os
 import time
 import urllib3
-import concurrent.futures
 import threading
+import xml.etree.ElementTree as ET
 from requests.auth import HTTPBasicAuth, HTTPDigestAuth
-from requests.adapters import HTTPAdapter
-from urllib.parse import urljoin, unquote, urlparse
+from urllib.parse import urljoin, urlparse
+from backend.entry import Entry
+from backend.propfind import iter_propfind, ServerProfile, PROPFIND_BODY, PROPFIND_HEADERS
+from backend.crawler import CrawlState, CrawlProfile, run_threaded, record_scan_stats, merge_profile, in_sample
+from backend.concurrency import ThrottledError, check_throttled, limit_for, budget_for
+from backend.sessions import session_registry
+from backend import metrics
+from backend.path_index import get_parent_path
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger("webdav-services")
 
+# Streamed listing bodies are read from resp.raw, so a stalled or reset
+# connection surfaces as urllib3's exceptions rather than requests'
+BODY_READ_ERRORS = (urllib3.exceptions.ReadTimeoutError, urllib3.exceptions.ProtocolError)
+
+class SharedDigestAuth(HTTPDigestAuth):
+    """HTTPDigestAuth whose challenge is shared by every thread.
+
+    requests keeps the Digest challenge thread-local, so each worker thread
+    of every run starts with a 401 round trip. Here the latest challenge and
+    nonce count are shared, so once any thread has been challenged the others
+    sign pre-emptively with the same nonce (incrementing nc) until the server
+    issues a new one.
+    """
+    def __init__(self, username, password):
+        super().__init__(username, password)
+        self._shared_lock = threading.Lock()
+        self._shared_chal = {}
+        self._shared_last_nonce = ""
+        self._shared_nonce_count = 0
+
+    def __call__(self, r):
+        self.init_per_thread_state()
+        with self._shared_lock:
+            if self._shared_chal:
+                self._thread_local.chal = self._shared_chal
+                self._thread_local.last_nonce = self._shared_last_nonce
+        return super().__call__(r)
+
+    def build_digest_header(self, method, url):
+        with self._shared_lock:
+            tl = self._thread_local
+            if tl.chal is not self._shared_chal:
+                # handle_401 just parsed a fresh challenge: publish it
+                self._shared_chal = tl.chal
+                self._shared_last_nonce = ""
+                self._shared_nonce_count = 0
+            tl.last_nonce = self._shared_last_nonce
+            tl.nonce_count = self._shared_nonce_count
+            header = super().build_digest_header(method, url)
+            self._shared_last_nonce = tl.last_nonce
+            self._shared_nonce_count = tl.nonce_count
+            return header
+
+def _jwt_expiry(token):
+    """exp claim of a JWT (epoch seconds), None when the token is not a JWT or has none."""
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except Exception:
+        return None
+
+class AlistToken:
+    """Alist token of one account, shared by scans, refreshes and the directory picker.
+
+    Tokens live in memory only. The expiry comes from the JWT's exp claim
+    (or DEFAULT_TTL after a login when there is none) and get() logs in
+    again REFRESH_MARGIN seconds before it. A token the server rejects is
+    dropped through invalidate(), so the next get() logs in afresh. Accounts
+    configured with just a token cannot log in and keep using that token.
+    """
+    REFRESH_MARGIN = 300
+    # Alist's default token_expires_in is 48 hours
+    DEFAULT_TTL = 48 * 3600
+
+    def __init__(self, url, username=None, password=None, token=None):
+        self.url = url.rstrip('/')
+        self.username = username
+        self.password = password
+        self._lock = threading.Lock()
+        self.token = None
+        self.expires_at = 0.0
+        if token:
+            self._set(token, None)
+
+    @property
+    def can_login(self):
+        return bool(self.username and self.password)
+
+    def _set(self, token, default_ttl):
+        self.token = token
+        exp = _jwt_expiry(token)
+        if exp is None:
+            exp = time.time() + default_ttl if default_ttl else float('inf')
+        self.expires_at = exp
+
+    def get(self):
+        """A usable token, logging in first when there is none or it is about to expire."""
+        with self._lock:
+            if self.token and (not self.can_login or time.time() < self.expires_at - self.REFRESH_MARGIN):
+                return self.token
+            if not self.can_login:
+                return None
+            token = AlistService.get_token(self.url, self.username, self.password)
+            if token:
+                logger.info(f"Obtained Alist token for {self.url}")
+                self._set(token, self.DEFAULT_TTL)
+            else:
+                logger.error(f"Alist login failed for {self.url}")
+            return self.token
+
+    def invalidate(self, token):
+        """Drop a token the server rejected. True when a retry can get a different one."""
+        with self._lock:
+            if token != self.token:
+                return True
+            if not self.can_login:
+                return False
+            self.token = None
+            return True
+
 class WebDAVService:
+    # Negotiated auth per account: (url, username, password) -> auth object.
+    # Kept for the life of the process so later runs skip negotiation too.
+    _auth_cache = {}
+    _auth_lock = threading.Lock()
+    # Capability profile per account, same key as the auth cache
+    _profiles = {}
+    INFINITY_MAX_ENTRIES = 500000
+
+    @staticmethod
+    def get_profile(url, username, password):
+        key = (url.rstrip('/'), username, password)
+        profile = WebDAVService._profiles.get(key)
+        if profile is None:
+            with WebDAVService._auth_lock:
+                profile = WebDAVService._profiles.setdefault(key, ServerProfile())
+        return profile
+
+    @staticmethod
+    def _propfind_headers(depth):
+        headers = {
+            'Depth': depth,
+            'User-Agent': 'WebDAV-Monitor-Premium',
+            'Accept': 'application/xml, text/xml'
+        }
+        headers.update(PROPFIND_HEADERS)
+        return headers
+
+    @staticmethod
+    def _unchanged(profile, current_entry, old_entry):
+        """Smart-scan test for a directory, using whichever signal the server keeps up to date."""
+        if profile.mtime_trusted:
+            cur, old = current_entry.mtime, old_entry.mtime
+            if cur and old:
+                return cur == old
+        if profile.etag_trusted:
+            cur, old = current_entry.tag, old_entry.tag
+            if cur and old:
+                return cur == old
+        return False
+
+    @staticmethod
+    def _authed_request(session, method, url, username, password, target_url, **kwargs):
+        """Send a request with the account's negotiated auth scheme.
+
+        The first request of an account goes out with Basic; if the server
+        answers 401 with a Digest challenge (or without offering Basic) it is
+        retried with Digest. Whichever scheme gets past the 401 is cached.
+        """
+        if session is None:
+            with session_registry.use(url, username) as session:
+                return WebDAVService._authed_request(session, method, url, username, password, target_url, **kwargs)
+        requester = session
+        key = (url.rstrip('/'), username, password)
+        auth = WebDAVService._auth_cache.get(key)
+        if auth is not None:
+            return requester.request(method, target_url, auth=auth, **kwargs)
+
+        auth = HTTPBasicAuth(username, password)
+        resp = requester.request(method, target_url, auth=auth, **kwargs)
+        if resp.status_code == 401:
+            challenge = resp.headers.get('WWW-Authenticate', '').lower()
+            if 'digest' in challenge or 'basic' not in challenge:
+                resp.close()
+                auth = SharedDigestAuth(username, password)
+                resp = requester.request(method, target_url, auth=auth, **kwargs)
+
+        if resp.status_code != 401:
+            with WebDAVService._auth_lock:
+                cached = WebDAVService._auth_cache.setdefault(key, auth)
+            if cached is auth:
+                logger.info(f"WebDAV auth for {key[0]} negotiated: {type(auth).__name__}")
+        return resp
+
     @staticmethod
     def test_connection(url, username, password):
         target_urls = [url.rstrip('/'), url.rstrip('/') + '/']
@@ -29,119 +219,69 @@ class WebDAVService:
         
         last_error = "Unknown Error"
         
-        for target_url in target_urls:
-            for auth in auth_methods:
-                try:
-                    logger.info(f"Testing WebDAV ({type(auth).__name__}): {target_url}")
-                    resp = requests.request('PROPFIND', target_url, auth=auth, headers=headers, timeout=10, verify=False)
+        # A test may run before the account is saved; its session is evicted when idle
+        with session_registry.use(url, username) as session:
+            for target_url in target_urls:
+                for auth in auth_methods:
+                    try:
+                        logger.info(f"Testing WebDAV ({type(auth).__name__}): {target_url}")
+                        resp = session.request('PROPFIND', target_url, auth=auth, headers=headers, timeout=10, verify=False)
                     
-                    if resp.status_code in [200, 207]:
-                        return True, "Success"
+                        if resp.status_code in [200, 207]:
+                            return True, "Success"
                     
-                    if resp.status_code == 401:
-                        last_error = "Authentication Failed: Check username/password"
-                        continue
+                        if resp.status_code == 401:
+                            last_error = "Authentication Failed: Check username/password"
+                            continue
                     
-                    if resp.status_code == 405:
-                        get_resp = requests.get(target_url, auth=auth, timeout=10, verify=False)
-                        if get_resp.status_code < 400:
-                            return True, "Success (GET fallback)"
-                        last_error = f"HTTP {get_resp.status_code}: GET failed"
-                    else:
-                        last_error = f"HTTP {resp.status_code}: {resp.reason}"
-                        if resp.text:
-                            last_error += f" ({resp.text[:50]}...)"
+                        if resp.status_code == 405:
+                            get_resp = session.get(target_url, auth=auth, timeout=10, verify=False)
+                            if get_resp.status_code < 400:
+                                return True, "Success (GET fallback)"
+                            last_error = f"HTTP {get_resp.status_code}: GET failed"
+                        else:
+                            last_error = f"HTTP {resp.status_code}: {resp.reason}"
+                            if resp.text:
+                                last_error += f" ({resp.text[:50]}...)"
                             
-                except requests.exceptions.RequestException as e:
-                    logger.error(f"WebDAV Test Attempt Failed: {e}")
-                    last_error = str(e)
+                    except requests.exceptions.RequestException as e:
+                        logger.error(f"WebDAV Test Attempt Failed: {e}")
+                        last_error = str(e)
                     
-        return False, last_error
+            return False, last_error
 
     @staticmethod
-    def _list_dir_worker(session, url, username, password, path):
-        results = {}
-        subdirs = []
-        
+    def _target_url(url, path):
         base_url = url if url.endswith('/') else url + '/'
         
         if path.startswith('http'):
-            target_url = path
-        else:
-            joined = urljoin(base_url, path)
-            if not joined.startswith(base_url.rstrip('/')):
-                target_url = base_url + path.lstrip('/')
-            else:
-                target_url = joined
-        
-        # Determine auth mechanism (basic vs digest)
-        # Optimization: We can't easily guess, so we try Basic first.
-        # Ideally, main thread detects auth type once and passes it down.
-        # But for robustness, we keep try-catch or assume Basic if not specified.
-        # Since session keeps connection alive, maybe auth header is cached?
-        # Requests Session handles cookies but not Basic Auth unless set on session.auth
-        # We'll set auth on session if possible, or pass it.
-        
-        # To avoid overhead of testing auth every time, we rely on passed params
-        # But requests require auth per request if not set on session.
-        
-        headers = {
-            'Depth': '1',
-            'User-Agent': 'WebDAV-Monitor-Premium',
-            'Accept': 'application/xml, text/xml'
-        }
-        
-        # Try passed auth (Basic)
-        # If session has auth set, we don't need to pass it.
-        # But we don't know if it's Basic or Digest.
-        # We will assume Basic for speed, fallback to Digest if 401.
-        
-        try:
-            # We use session.request
-            resp = session.request('PROPFIND', target_url, auth=HTTPBasicAuth(username, password), headers=headers, timeout=60, verify=False)
-            if resp.status_code == 401:
-                # Fallback to Digest
-                resp = session.request('PROPFIND', target_url, auth=HTTPDigestAuth(username, password), headers=headers, timeout=60, verify=False)
-            resp.raise_for_status()
-        except Exception as e:
-            logger.error(f"WebDAV scan error for {path}: {e}")
-            raise e
-        
-        try:
-            content = xmltodict.parse(resp.content.decode('utf-8'))
-        except Exception as e:
-             logger.error(f"XML Parse error for {path}: {e}")
-             return {}, []
+            return path
+        joined = urljoin(base_url, path)
+        if not joined.startswith(base_url.rstrip('/')):
+            return base_url + path.lstrip('/')
+        return joined
 
-        multistatus = content.get('D:multistatus', {}) or content.get('multistatus', {})
-        responses = multistatus.get('D:response', []) or multistatus.get('response', [])
+    @staticmethod
+    def _collect_listing(items, url, path):
+        """Turn the parsed entries of one Depth: 1 listing into (results, subdirs, missing props)."""
+        results = {}
+        subdirs = []
+        missing = set()
+        clean_path = path.rstrip('/')
         
-        if isinstance(responses, dict):
-            responses = [responses]
-            
-        for res in responses:
-            href = unquote(res.get('D:href', '') or res.get('href', ''))
+        for item in items:
+            missing.update(item['missing'])
+            href = item['href']
             clean_href = href.rstrip('/')
-            
-            propstat = res.get('D:propstat', {}) or res.get('propstat', {})
-            if isinstance(propstat, list):
-                propstat = propstat[0]
-            prop = propstat.get('D:prop', {}) or propstat.get('prop', {})
-            
-            resourcetype = prop.get('D:resourcetype', {}) or prop.get('resourcetype', {})
-            is_dir = 'D:collection' in resourcetype or 'collection' in resourcetype if resourcetype else False
+            is_dir = item['is_dir']
             
             is_self = False
-            if clean_href.rstrip('/') == path.rstrip('/'):
+            if clean_href == clean_path:
                 is_self = True
-            elif clean_href.endswith(path.rstrip('/')) and (len(clean_href) == len(path.rstrip('/')) or clean_href[-(len(path.rstrip('/'))+1)] == '/'):
+            elif clean_href.endswith(clean_path) and (len(clean_href) == len(clean_path) or clean_href[-(len(clean_path)+1)] == '/'):
                 is_self = True
 
-            mtime = prop.get('D:getlastmodified', '') or prop.get('getlastmodified', '')
-            etag = prop.get('D:getetag', '') or prop.get('getetag', '')
-            size = prop.get('D:getcontentlength', '0') or prop.get('getcontentlength', '0')
-
-            entry = {"size": size, "mtime": mtime, "etag": etag, "is_dir": is_dir}
+            entry = Entry.build(is_dir, item['size'], item['mtime'], item['etag'])
             
             if is_self:
                 results[clean_href] = entry
@@ -157,108 +297,157 @@ class WebDAVService:
                     except:
                         sub_path = href.split(url.rstrip('/'))[-1]
                 subdirs.append(sub_path)
-                
-        return results, subdirs
+        
+        return results, subdirs, missing
 
     @staticmethod
-    def list_recursive(url, username, password, path, old_state=None, smart_scan=True, concurrency=10):
-        mode_str = "Smart" if smart_scan else "Deep"
-        logger.info(f"Starting {mode_str} WebDAV scan for {path} (Threads: {concurrency})")
-        start_time = time.time()
+    def _list_dir_worker(session, url, username, password, path):
+        target_url = WebDAVService._target_url(url, path)
         
-        all_results = {}
-        visited = set()
-        visited_lock = threading.Lock()
+        headers = WebDAVService._propfind_headers('1')
+        start = time.monotonic()
         
-        visited.add(path)
+        try:
+            # Auth scheme is negotiated once per account and reused afterwards
+            resp = WebDAVService._authed_request(session, 'PROPFIND', url, username, password, target_url, data=PROPFIND_BODY, headers=headers, timeout=60, verify=False, stream=True)
+        except requests.exceptions.Timeout as e:
+            metrics.listing_failed("webdav", url)
+            raise ThrottledError(f"Timeout: {e}")
+        except Exception as e:
+            metrics.listing_failed("webdav", url)
+            logger.error(f"WebDAV scan error for {path}: {e}")
+            raise e
         
-        # Init Session with Connection Pooling
-        session = requests.Session()
-        max_workers = concurrency
-        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=3)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
+        # Streamed: the connection only goes back to the pool once the response is closed
+        with resp:
+            try:
+                check_throttled(resp.status_code, resp.headers)
+                resp.raise_for_status()
+            except ThrottledError:
+                metrics.listing_failed("webdav", url)
+                raise
+            except Exception as e:
+                metrics.listing_failed("webdav", url)
+                logger.error(f"WebDAV scan error for {path}: {e}")
+                raise e
+            
+            try:
+                results, subdirs, missing = WebDAVService._collect_listing(iter_propfind(resp), url, path)
+            except ET.ParseError as e:
+                metrics.listing_failed("webdav", url)
+                logger.error(f"XML Parse error for {path}: {e}")
+                return {}, []
+            except BODY_READ_ERRORS as e:
+                # Retried like a timeout: dropping the directory would report its subtree as deleted
+                metrics.listing_failed("webdav", url)
+                raise ThrottledError(f"Body read failed: {e}")
         
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
-        futures = {}
+        metrics.observe_listing("webdav", url, "PROPFIND", time.monotonic() - start, len(results), resp.raw.tell())
+        WebDAVService.get_profile(url, username, password).observe(results.values(), missing, resp.headers.get('Content-Encoding', ''))
+        return results, subdirs
+
+    @staticmethod
+    def _list_infinity(session, url, username, password, path):
+        """List a whole subtree with a single streamed Depth: infinity PROPFIND.
+
+        Returns the results dict keyed like _list_dir_worker, or None when the
+        server refuses infinite depth, the body breaks off or the listing grows
+        past INFINITY_MAX_ENTRIES; the caller then falls back to the Depth: 1
+        crawl.
+        """
+        profile = WebDAVService.get_profile(url, username, password)
+        if profile.depth_infinity is False or path in profile.too_large_paths:
+            return None
         
-        # Initial task
-        f = executor.submit(WebDAVService._list_dir_worker, session, url, username, password, path)
-        futures[f] = (path, 0)
+        target_url = WebDAVService._target_url(url, path)
+        headers = WebDAVService._propfind_headers('infinity')
+        start = time.monotonic()
         
-        # Smart scan helper: Function to copy descendants
-        def copy_descendants_from_old_state(skip_path):
-            count = 0
-            if not old_state: return 0
+        resp = WebDAVService._authed_request(session, 'PROPFIND', url, username, password, target_url, data=PROPFIND_BODY, headers=headers, timeout=60, verify=False, stream=True)
+        with resp:
+            if resp.status_code != 207:
+                if resp.status_code == 403 and 'propfind-finite-depth' in resp.text:
+                    logger.info(f"Server {url} refuses Depth: infinity, using Depth: 1 crawl from now on.")
+                    profile.depth_infinity = False
+                else:
+                    logger.warning(f"Depth: infinity listing of {path} failed (HTTP {resp.status_code}), falling back to Depth: 1 crawl.")
+                return None
+            profile.depth_infinity = True
             
-            # Simple prefix match (can be optimized if needed, but acceptable for now)
-            prefix = skip_path + "/"
-            for k, v in old_state.items():
-                if k == skip_path: continue
-                if k.startswith(prefix):
-                    all_results[k] = v
-                    count += 1
-            return count
+            results = {}
+            missing = set()
+            try:
+                for item in iter_propfind(resp):
+                    missing.update(item['missing'])
+                    clean_href = item['href'].rstrip('/')
+                    results[clean_href] = Entry.build(item['is_dir'], item['size'], item['mtime'], item['etag'])
+                    if len(results) > WebDAVService.INFINITY_MAX_ENTRIES:
+                        logger.warning(f"Depth: infinity listing of {path} exceeded {WebDAVService.INFINITY_MAX_ENTRIES} entries, falling back to Depth: 1 crawl.")
+                        profile.too_large_paths.add(path)
+                        return None
+            except ET.ParseError as e:
+                logger.warning(f"Depth: infinity listing of {path} is not valid XML ({e}), falling back to Depth: 1 crawl.")
+                return None
+            except BODY_READ_ERRORS as e:
+                logger.warning(f"Depth: infinity listing of {path} broke off ({e}), falling back to Depth: 1 crawl.")
+                return None
+        metrics.observe_listing("webdav", url, "PROPFIND infinity", time.monotonic() - start, len(results), resp.raw.tell())
+        profile.observe(results.values(), missing, resp.headers.get('Content-Encoding', ''))
+        return results
+
+    @staticmethod
+    def list_recursive(url, username, password, path, old_state=None, smart_scan=True, concurrency=10, depth_infinity=False, engine="threads", max_concurrency=0, stats=None, on_listing=None):
+        mode_str = "Smart" if smart_scan else "Deep"
         
+        # The account's pooled session: connections stay open between runs
+        session = session_registry.acquire(url, username)
         try:
-            while futures:
-                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
-                
-                for fut in done:
-                    p, depth = futures.pop(fut)
-                    try:
-                        res, subdirs = fut.result()
-                        
-                        # Add current dir results
-                        all_results.update(res)
-                        
-                        # Logic for subdirs
-                        if depth < 50: 
-                            for sd_raw in subdirs:
-                                sd_clean = sd_raw.rstrip('/')
-                                
-                                # Check lock
-                                should_process = False
-                                with visited_lock:
-                                    if sd_clean not in visited:
-                                        visited.add(sd_clean)
-                                        should_process = True
-                                
-                                if should_process:
-                                    # SMART SCAN LOGIC
-                                    should_recurse = True
-                                    
-                                    if smart_scan and old_state and sd_clean in old_state and sd_clean in res:
-                                        # Check if modified
-                                        current_entry = res[sd_clean]
-                                        old_entry = old_state[sd_clean]
-                                        
-                                        # Compare mtime
-                                        cur_mtime = current_entry.get('mtime')
-                                        old_mtime = old_entry.get('mtime')
-                                        
-                                        if cur_mtime and old_mtime and cur_mtime == old_mtime:
-                                            # Match! Skip recursion
-                                            logger.debug(f"SmartScan: Skipping unchanged {sd_clean}")
-                                            should_recurse = False
-                                            # We must copy descendants!
-                                            # This happens in main thread, safe.
-                                            copied = copy_descendants_from_old_state(sd_clean)
-                                            # logger.debug(f"  -> Copied {copied} items")
-
-                                    if should_recurse:
-                                        # Submit new task
-                                        new_f = executor.submit(WebDAVService._list_dir_worker, session, url, username, password, sd_raw)
-                                        futures[new_f] = (sd_raw, depth + 1)
-                                    
-                    except Exception as e:
-                        logger.error(f"Failed to scan {p}: {e}")
-                        
-        finally:
-            executor.shutdown(wait=False)
-            session.close()
+            if depth_infinity:
+                logger.info(f"Starting Depth: infinity WebDAV scan for {path}")
+                start_time = time.time()
+                # Its own limit and lease: a fallback crawl starts from fresh ones
+                bulk = limit_for(concurrency, max_concurrency, budget_for(url))
+                try:
+                    with bulk.lease.slot():
+                        results = WebDAVService._list_infinity(session, url, username, password, path)
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f"Depth: infinity listing of {path} failed ({e}), falling back to Depth: 1 crawl.")
+                    results = None
+                finally:
+                    bulk.close()
+                if results is not None:
+                    if on_listing:
+                        on_listing(results)
+                    profile = CrawlProfile()
+                    profile.listing(path, 0, time.time() - start_time, len(results))
+                    record_scan_stats(stats, bulk, listed=1, profile=profile)
+                    logger.info(f"WebDAV Scan finished in {time.time() - start_time:.2f}s (Depth: infinity). Total: {len(results)}")
+                    return results
+            
+            limit = limit_for(concurrency, max_concurrency, budget_for(url))
+            if engine == "async":
+                from backend import async_crawler
+                if async_crawler.available():
+                    return async_crawler.list_recursive_webdav(url, username, password, path, limit, old_state=old_state, smart_scan=smart_scan, stats=stats, on_listing=on_listing)
+                logger.warning("httpx is not installed, falling back to the thread pool crawler.")
             
-        logger.info(f"WebDAV Scan finished in {time.time() - start_time:.2f}s. Scanned {len(visited)} dirs. Total: {len(all_results)}")
+            logger.info(f"Starting {mode_str} WebDAV scan for {path} (Threads: {limit.current}, max {limit.maximum})")
+            start_time = time.time()
+            profile = WebDAVService.get_profile(url, username, password)
+            
+            crawl = CrawlState(path, old_state, smart_scan,
+                               unchanged=lambda cur, old: WebDAVService._unchanged(profile, cur, old),
+                               max_depth=50, on_listing=on_listing)
+            run_threaded(crawl, lambda p: WebDAVService._list_dir_worker(session, url, username, password, p), path, limit)
+        finally:
+            session_registry.release(session)
+        
+        record_scan_stats(stats, limit, crawl)
+        all_results = crawl.results
+        if crawl.summary():
+            logger.info(crawl.summary())
+        logger.info(f"WebDAV Scan finished in {time.time() - start_time:.2f}s. Scanned {len(crawl.visited)} dirs. Total: {len(all_results)}. Concurrency converged at {limit.current}.")
+        logger.debug(f"WebDAV server profile for {url}: {profile.as_dict()}")
         return all_results
 
     @staticmethod
@@ -274,48 +463,94 @@ class WebDAVService:
             
         if not target_url.endswith('/'): target_url += '/'
         
-        auth_methods = [HTTPBasicAuth(username, password), HTTPDigestAuth(username, password)]
-        headers = {'Depth': '1', 'User-Agent': 'WebDAV-Monitor-Premium'}
+        headers = WebDAVService._propfind_headers('1')
         
-        for auth in auth_methods:
-            try:
-                resp = requests.request('PROPFIND', target_url, auth=auth, headers=headers, timeout=15, verify=False)
-                if resp.status_code == 401: continue
-                resp.raise_for_status()
-                
-                content = xmltodict.parse(resp.content.decode('utf-8'))
-                multistatus = content.get('D:multistatus', {}) or content.get('multistatus', {})
-                responses = multistatus.get('D:response', []) or multistatus.get('response', [])
-                
-                if isinstance(responses, dict):
-                    responses = [responses]
-                    
-                items = []
-                for res in responses:
-                    href = unquote(res.get('D:href', '') or res.get('href', ''))
-                    clean_href = href.rstrip('/')
+        try:
+            resp = WebDAVService._authed_request(None, 'PROPFIND', url, username, password, target_url, data=PROPFIND_BODY, headers=headers, timeout=15, verify=False, stream=True)
+            resp.raise_for_status()
+            
+            clean_path = path.rstrip('/')
+            items = []
+            with resp:
+                for item in iter_propfind(resp):
+                    clean_href = item['href'].rstrip('/')
                     
-                    if clean_href.rstrip('/') == path.rstrip('/'): continue
-                    if clean_href.endswith(path.rstrip('/')) and (len(clean_href) == len(path.rstrip('/')) or clean_href[-(len(path.rstrip('/'))+1)] == '/'):
+                    if clean_href == clean_path: continue
+                    if clean_href.endswith(clean_path) and (len(clean_href) == len(clean_path) or clean_href[-(len(clean_path)+1)] == '/'):
                          continue
 
                     name = os.path.basename(clean_href) or clean_href
-                    
-                    propstat = res.get('D:propstat', {}) or res.get('propstat', {})
-                    if isinstance(propstat, list): propstat = propstat[0]
-                    prop = propstat.get('D:prop', {}) or propstat.get('prop', {})
-                    resourcetype = prop.get('D:resourcetype', {}) or prop.get('resourcetype', {})
-                    is_dir = 'D:collection' in resourcetype or 'collection' in resourcetype if resourcetype else False
-                    
-                    items.append({"name": name, "is_dir": is_dir, "path": clean_href})
-                return items
-            except:
-                continue
+                    items.append({"name": name, "is_dir": item['is_dir'], "path": clean_href})
+            return items
+        except Exception as e:
+            logger.error(f"WebDAV list_directory failed: {e}")
         return []
 
 class AlistService:
+    # Token manager per account: (url, username, password, token) -> AlistToken
+    _tokens = {}
+    _tokens_lock = threading.Lock()
+
+    @staticmethod
+    def get_auth(url, username=None, password=None, token=None):
+        """Shared AlistToken for an account. The stored token only identifies accounts without credentials."""
+        key = (url.rstrip('/'), username or "", password or "", "" if username and password else (token or ""))
+        with AlistService._tokens_lock:
+            auth = AlistService._tokens.get(key)
+            if auth is None:
+                auth = AlistToken(url, username, password, token)
+                AlistService._tokens[key] = auth
+            return auth
+
+    @staticmethod
+    def _api_post(auth, endpoint, payload, session=None, timeout=60, observe=True):
+        """POST to an Alist API endpoint with the account token.
+
+        A rejected token (HTTP 401 or code 401) is replaced and the request
+        retried once. Returns (response, data); data is the decoded body of
+        an HTTP 200 response, else None. With observe, the call is recorded
+        in the listing metrics.
+        """
+        if session is None:
+            with session_registry.use(auth.url, auth.username) as session:
+                return AlistService._api_post(auth, endpoint, payload, session, timeout, observe)
+        for attempt in range(2):
+            token = auth.get()
+            start = time.monotonic()
+            try:
+                resp = session.post(f"{auth.url}{endpoint}",
+                    headers={"Authorization": token or "", "User-Agent": "WebDAV-Monitor-Premium"},
+                    json=payload, timeout=timeout, verify=False
+                )
+            except requests.exceptions.RequestException:
+                if observe:
+                    metrics.listing_failed("alist", auth.url)
+                raise
+            data = resp.json() if resp.status_code == 200 else None
+            if observe:
+                AlistService._observe(auth.url, endpoint, payload, time.monotonic() - start, resp, data)
+            unauthorized = resp.status_code == 401 or (data is not None and data.get('code') == 401)
+            if unauthorized and attempt == 0 and auth.invalidate(token):
+                logger.info(f"Alist token for {auth.url} was rejected, logging in again")
+                continue
+            return resp, data
+
+    @staticmethod
+    def _observe(url, endpoint, payload, seconds, resp, data):
+        if data is None or data.get('code') != 200:
+            metrics.listing_failed("alist", url)
+            return
+        method = endpoint.rsplit('/', 1)[-1] + (" refresh" if payload.get("refresh") else "")
+        content = (data.get('data') or {}).get('content') or []
+        metrics.observe_listing("alist", url, method, seconds, len(content), len(resp.content))
+
     @staticmethod
     def test_connection(url, username=None, password=None, token=None):
+        with session_registry.use(url, username) as session:
+            return AlistService._test_connection(session, url, username, password, token)
+
+    @staticmethod
+    def _test_connection(session, url, username, password, token):
         try:
             base_url = url.rstrip('/')
             
@@ -324,7 +559,7 @@ class AlistService:
                     return False, "Username/Password required for login"
                 
                 logger.info(f"Logging in to Alist: {base_url}")
-                resp = requests.post(f"{base_url}/api/auth/login", json={
+                resp = session.post(f"{base_url}/api/auth/login", json={
                     "username": username,
                     "password": password
                 }, timeout=15, verify=False)
@@ -340,7 +575,7 @@ class AlistService:
             
             logger.info(f"Verifying Alist connectivity: {base_url}")
             headers = {"Authorization": token, "User-Agent": "WebDAV-Monitor-Premium"}
-            resp = requests.post(f"{base_url}/api/fs/list", 
+            resp = session.post(f"{base_url}/api/fs/list", 
                 headers=headers,
                 json={"path": "/", "page": 1, "per_page": 1},
                 timeout=15, verify=False
@@ -363,10 +598,11 @@ class AlistService:
     @staticmethod
     def get_token(url, username, password):
         try:
-            resp = requests.post(f"{url.rstrip('/')}/api/auth/login", json={
-                "username": username,
-                "password": password
-            }, timeout=10, verify=False)
+            with session_registry.use(url, username) as session:
+                resp = session.post(f"{url.rstrip('/')}/api/auth/login", json={
+                    "username": username,
+                    "password": password
+                }, timeout=10, verify=False)
             if resp.status_code == 200:
                 data = resp.json()
                 if data.get('code') == 200:
@@ -376,164 +612,203 @@ class AlistService:
         return None
 
     @staticmethod
-    def refresh_path(url, token, path):
+    def refresh_path(auth, path, session=None):
+        # Recorded as a refresh only, not in the listing metrics
+        start = time.monotonic()
+        ok = AlistService._refresh_path(auth, path, session)
+        metrics.observe_refresh(auth.url, time.monotonic() - start, ok)
+        return ok
+
+    @staticmethod
+    def _refresh_path(auth, path, session):
         try:
             logger.info(f"Triggering Alist refresh for: {path}")
-            resp = requests.post(f"{url.rstrip('/')}/api/fs/list", 
-                headers={"Authorization": token, "User-Agent": "WebDAV-Monitor-Premium"},
-                json={
+            resp, data = AlistService._api_post(auth, "/api/fs/list", {
                     "path": path,
                     "refresh": True,
                     "page": 1,
                     "per_page": 1
-                }, timeout=60, verify=False
-            )
-            data = resp.json()
-            return data.get('code') == 200
+                }, session=session, observe=False)
+            if data is None:
+                logger.error(f"Refresh failed for {path}: HTTP {resp.status_code}")
+                return False
+            if data.get('code') != 200:
+                logger.error(f"Refresh failed for {path}: {data.get('message', 'Unknown')}")
+                return False
+            return True
         except Exception as e:
             logger.error(f"Refresh failed for {path}: {e}")
             return False
 
     @staticmethod
-    def list_directory(url, token, path):
+    def list_directory(auth, path, per_page=200):
         try:
-            headers = {"Authorization": token, "User-Agent": "WebDAV-Monitor-Premium"}
-            resp = requests.post(f"{url.rstrip('/')}/api/fs/list", 
-                headers=headers,
-                json={"path": path, "page": 1, "per_page": 200},
-                timeout=15, verify=False
-            )
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get('code') == 200:
-                    files = data['data'].get('content') or []
-                    return [{"name": f['name'], "is_dir": f['is_dir'], "path": os.path.join(path, f['name']), "size": f.get('size'), "mtime": f.get('modified')} for f in files]
+            files = []
+            page = 1
+            while True:
+                resp, data = AlistService._api_post(auth, "/api/fs/list", {"path": path, "page": page, "per_page": per_page}, timeout=15)
+                if data is None or data.get('code') != 200:
+                    break
+                content = data['data'].get('content') or []
+                files.extend(content)
+                if not content or len(files) >= data['data'].get('total', 0):
+                    break
+                # per_page 0 on a server that caps pages: continue with its page size
+                per_page = per_page or len(content)
+                page += 1
+            return [{"name": f['name'], "is_dir": f['is_dir'], "path": os.path.join(path, f['name']), "size": f.get('size'), "mtime": f.get('modified')} for f in files]
         except Exception as e:
             logger.error(f"Alist list_directory failed: {e}")
         return []
 
     @staticmethod
-    def _list_dir_rich_worker(session, url, token, path, refresh=False):
+    def _collect_page(path, content, results, subdirs):
+        for f in content:
+            full_path = os.path.join(path, f['name'])
+            mtime = f.get('modified')
+            sign = f.get('sign') or f.get('hash')
+            size = f.get('size')
+            is_dir = f['is_dir']
+            
+            results[full_path] = Entry.build(is_dir, size, mtime, sign)
+            
+            if is_dir:
+                subdirs.append(full_path)
+
+    @staticmethod
+    def _unchanged(current_entry, old_entry):
+        cur_mtime = current_entry.mtime
+        old_mtime = old_entry.mtime
+        return bool(cur_mtime and old_mtime and cur_mtime == old_mtime)
+
+    @staticmethod
+    def _page_key(key, per_page):
+        """(path, page, per_page) of a crawl work item: a bare path is its first page."""
+        if isinstance(key, tuple):
+            return key
+        return key, 1, per_page
+
+    @staticmethod
+    def _page_listing(path, page, per_page, data):
+        """(results, subdirs, follow-up pages) from one decoded /api/fs/list response.
+
+        The first page's total turns into work items for the remaining pages,
+        which the crawl engines fetch in parallel like any other listing.
+        A server that caps the page below per_page (or with per_page 0,
+        everything at once) is paged by the size it actually returned.
+        """
+        if data.get('code') != 200:
+            raise Exception(f"Alist API error: {data.get('message', 'Unknown')}")
+        content = data['data'].get('content') or []
         results = {}
         subdirs = []
-        headers = {"Authorization": token, "User-Agent": "WebDAV-Monitor-Premium"}
-        
-        page = 1
-        while True:
-            try:
-                # Use session
-                resp = session.post(f"{url.rstrip('/')}/api/fs/list", 
-                    headers=headers,
-                    json={"path": path, "page": page, "per_page": 200, "refresh": refresh},
-                    timeout=60, verify=False
-                )
-                if resp.status_code != 200: break
-                
-                data = resp.json()
-                if data.get('code') != 200:
-                    # Log but don't break immediately if page 1 failed? 
-                    # If page 1 fails, we raise.
-                    if page == 1:
-                        raise Exception(f"Alist API error: {data.get('message', 'Unknown')}")
-                    break
-                    
-                content = data['data'].get('content') or []
-                if not content: break
-                
-                for f in content:
-                    full_path = os.path.join(path, f['name'])
-                    mtime = f.get('modified')
-                    sign = f.get('sign') or f.get('hash')
-                    size = f.get('size')
-                    is_dir = f['is_dir']
-                    
-                    results[full_path] = {"size": size, "mtime": mtime, "sign": sign, "is_dir": is_dir}
-                    
-                    if is_dir:
-                        subdirs.append(full_path)
-                
-                total = data['data'].get('total', 0)
-                if page * 200 >= total: break
-                page += 1
-            except Exception as e:
-                logger.error(f"Error listing Alist path {path}: {e}")
-                raise e
-            
-        return results, subdirs
+        AlistService._collect_page(path, content, results, subdirs)
+
+        more = []
+        total = data['data'].get('total', 0)
+        if page == 1 and content and total > len(content):
+            size = min(per_page, len(content)) if per_page else len(content)
+            more = [(path, n, size) for n in range(2, -(-total // size) + 1)]
+        return results, subdirs, more
+
+    @staticmethod
+    def _list_dir_rich_worker(session, auth, key, refresh=False, per_page=200):
+        path, page, per_page = AlistService._page_key(key, per_page)
+        try:
+            # Use session
+            resp, data = AlistService._api_post(auth, "/api/fs/list",
+                {"path": path, "page": page, "per_page": per_page, "refresh": refresh}, session=session)
+            check_throttled(resp.status_code, resp.headers)
+            if data is None:
+                raise Exception(f"HTTP {resp.status_code}")
+            return AlistService._page_listing(path, page, per_page, data)
+        except requests.exceptions.Timeout as e:
+            raise ThrottledError(f"Timeout: {e}")
+        except ThrottledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error listing Alist path {path} (page {page}): {e}")
+            raise e
 
     @staticmethod
-    def list_recursive_rich(url, token, path, old_state=None, refresh=False, smart_scan=True, concurrency=10):
+    def list_recursive_rich(auth, path, old_state=None, refresh=False, smart_scan=True, concurrency=10, engine="threads", max_concurrency=0, stats=None, on_listing=None, per_page=200, force_visit=None):
+        limit = limit_for(concurrency, max_concurrency, budget_for(auth.url))
+        if engine == "async":
+            from backend import async_crawler
+            if async_crawler.available():
+                return async_crawler.list_recursive_alist(auth, path, limit, old_state=old_state, refresh=refresh, smart_scan=smart_scan, stats=stats, on_listing=on_listing, per_page=per_page, force_visit=force_visit)
+            logger.warning("httpx is not installed, falling back to the thread pool crawler.")
+        
         mode_str = "Smart" if smart_scan else "Deep"
-        logger.info(f"Starting {mode_str} Alist scan for {path} (Threads: {concurrency})")
+        if refresh:
+            mode_str += " refreshing"
+        logger.info(f"Starting {mode_str} Alist scan for {path} (Threads: {limit.current}, max {limit.maximum})")
         start_time = time.time()
         
-        all_results = {}
-        visited = set()
-        visited_lock = threading.Lock()
-        visited.add(path)
-        
-        # Init Session
-        session = requests.Session()
-        max_workers = concurrency
-        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=3)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
+        crawl = CrawlState(path, old_state, smart_scan, unchanged=AlistService._unchanged, max_depth=20, on_listing=on_listing, force_visit=force_visit)
         
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
-        futures = {}
-        
-        f = executor.submit(AlistService._list_dir_rich_worker, session, url, token, path, refresh)
-        futures[f] = (path, 0)
-        
-        def copy_descendants_from_old_state(skip_path):
-            count = 0
-            if not old_state: return 0
-            prefix = skip_path + "/"
-            for k, v in old_state.items():
-                if k == skip_path: continue
-                if k.startswith(prefix):
-                    all_results[k] = v
-                    count += 1
-            return count
+        # The account's pooled session: connections stay open between runs
+        session = session_registry.acquire(auth.url, auth.username)
         
         try:
-            while futures:
-                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
-                for fut in done:
-                    p, depth = futures.pop(fut)
-                    try:
-                        res, subdirs = fut.result()
-                        all_results.update(res)
-                        
-                        if depth < 20:
-                            for sd in subdirs:
-                                
-                                should_process = False
-                                with visited_lock:
-                                    if sd not in visited:
-                                        visited.add(sd)
-                                        should_process = True
-                                        
-                                if should_process:
-                                    # SMART Logic
-                                    should_recurse = True
-                                    if smart_scan and old_state and sd in old_state and sd in res:
-                                        cur_mtime = res[sd].get('mtime')
-                                        old_mtime = old_state[sd].get('mtime')
-                                        if cur_mtime and old_mtime and cur_mtime == old_mtime:
-                                            logger.info(f"SmartScan: Skipping {sd} (Matches old state)")
-                                            should_recurse = False
-                                            copied = copy_descendants_from_old_state(sd)
-                                            logger.info(f"SmartScan: Copied {copied} items for {sd}")
-                                    
-                                    if should_recurse:
-                                        new_f = executor.submit(AlistService._list_dir_rich_worker, session, url, token, sd, refresh)
-                                        futures[new_f] = (sd, depth + 1)
-                    except Exception as e:
-                        logger.error(f"Failed to scan {p}: {e}")
+            run_threaded(crawl, lambda p: AlistService._list_dir_rich_worker(session, auth, p, refresh, per_page), path, limit)
         finally:
-            executor.shutdown(wait=False)
-            session.close()
-            
-        logger.info(f"Alist Scan finished in {time.time() - start_time:.2f}s. Scanned {len(visited)} dirs. Total: {len(all_results)}")
+            session_registry.release(session)
+        
+        record_scan_stats(stats, limit, crawl)
+        all_results = crawl.results
+        if crawl.summary():
+            logger.info(crawl.summary())
+        logger.info(f"Alist Scan finished in {time.time() - start_time:.2f}s. Scanned {len(crawl.visited)} dirs. Total: {len(all_results)}. Concurrency converged at {limit.current}.")
         return all_results
+
+    @staticmethod
+    def list_recursive_changed(auth, path, old_state=None, smart_scan=True, sample_percent=0, sample_slot=0, stats=None, on_listing=None, **crawl_args):
+        """Source refresh limited to directories that look changed.
+
+        Phase 1 crawls Alist's cache (refresh=False). Directories whose
+        mtime or size differs from old_state, new directories and a rotating
+        sample_percent of the rest become candidates. Phase 2 crawls again
+        with refresh=True, skipping every directory whose refreshed entry
+        matches the cached one unless it is a candidate or leads to one, so
+        only candidates, their ancestors and whatever turns out to differ
+        upstream are re-listed from the drive.
+        """
+        old_state = old_state or {}
+        cached = AlistService.list_recursive_rich(auth, path, old_state=old_state, refresh=False, smart_scan=smart_scan, stats=stats, **crawl_args)
+
+        force_visit = set()
+        changed = sampled = dirs = 0
+        for href, entry in cached.items():
+            if not entry.is_dir:
+                continue
+            dirs += 1
+            old = old_state.get(href)
+            if old is None or old.mtime != entry.mtime or old.size != entry.size:
+                changed += 1
+            elif in_sample(href, sample_percent, sample_slot):
+                sampled += 1
+            else:
+                continue
+            # The candidate and every directory leading to it
+            d = href
+            while d not in force_visit and d.rstrip('/') and d != path.rstrip('/'):
+                force_visit.add(d)
+                d = get_parent_path(d)
+        logger.info(f"Alist source refresh: {changed} changed and {sampled} sampled of {dirs} directories.")
+
+        refresh_stats = {}
+        refreshed = AlistService.list_recursive_rich(auth, path, old_state=cached, refresh=True, smart_scan=True, stats=refresh_stats,
+                                                     on_listing=on_listing, force_visit=force_visit, **crawl_args)
+        if stats is not None:
+            for key in ('throttled', 'retries', 'dirs_listed', 'dirs_skipped'):
+                stats[key] = stats.get(key, 0) + refresh_stats.get(key, 0)
+            # The refresh pass is the one that hits the drive: report where its limit converged
+            if 'concurrency' in refresh_stats:
+                stats['concurrency'] = refresh_stats['concurrency']
+            merge_profile(stats, refresh_stats.get('profile'))
+
+        # Entries carried over from the cached pass were never streamed
+        if on_listing:
+            on_listing(refreshed)
+        return refreshed
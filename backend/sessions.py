@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from backend.concurrency import MAX_LIMIT, HOST_MAX_IN_FLIGHT
+
+logger = logging.getLogger("sessions")
+
+# Sessions unused for this long are closed (their idle connections with them)
+IDLE_TIMEOUT = 300
+# Connections kept open per account: enough for the largest crawl pool
+POOL_SIZE = max(MAX_LIMIT, HOST_MAX_IN_FLIGHT)
+
+
+def _account_key(url, username=None):
+    return ((url or "").rstrip('/'), username or "")
+
+
+class _Entry:
+    __slots__ = ("session", "users", "last_used", "retired")
+
+    def __init__(self, session):
+        self.session = session
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.retired = False
+
+
+class SessionRegistry:
+    """One long-lived requests.Session per account (base URL + username).
+
+    Scans, refreshes and API calls of an account share the session's
+    keep-alive connection pool, so later runs and file-picker requests skip
+    the TCP and TLS handshakes. acquire() and release() count users; a
+    session nobody has used for IDLE_TIMEOUT seconds is closed, and
+    invalidate() (account updated or deleted) retires the account's session:
+    it is closed as soon as its current users release it, and the next
+    acquire() opens a new one.
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, pool_size=POOL_SIZE):
+        self.idle_timeout = idle_timeout
+        self.pool_size = pool_size
+        self._entries = {}
+        self._by_session = {}
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=3)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _evict_idle(self, now):
+        for key, entry in list(self._entries.items()):
+            if not entry.users and now - entry.last_used > self.idle_timeout:
+                del self._entries[key]
+                self._close(entry)
+
+    def _close(self, entry):
+        self._by_session.pop(id(entry.session), None)
+        entry.session.close()
+
+    def acquire(self, url, username=None):
+        """The account's shared session; hand it back with release()."""
+        key = _account_key(url, username)
+        with self._lock:
+            now = time.monotonic()
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(self._new_session())
+                self._by_session[id(entry.session)] = entry
+            entry.users += 1
+            entry.last_used = now
+            return entry.session
+
+    def release(self, session):
+        with self._lock:
+            entry = self._by_session.get(id(session))
+            if entry is None:
+                return
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+            if entry.retired and not entry.users:
+                self._close(entry)
+
+    @contextmanager
+    def use(self, url, username=None):
+        session = self.acquire(url, username)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def invalidate(self, url, username=None):
+        """Stop reusing the account's session (account changed or removed)."""
+        with self._lock:
+            entry = self._entries.pop(_account_key(url, username), None)
+            if entry is None:
+                return
+            entry.retired = True
+            if not entry.users:
+                self._close(entry)
+        logger.info(f"Closed pooled HTTP session for {url}")
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            for entry in entries:
+                entry.retired = True
+                if not entry.users:
+                    self._close(entry)
+
+
+session_registry = SessionRegistry()
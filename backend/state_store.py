@@ -0,0 +1,138 @@
+import gzip
+import json
+import logging
+import os
+import sqlite3
+from backend.entry import Entry
+from backend.path_index import get_parent_path
+
+logger = logging.getLogger("state-store")
+
+STATE_DIR = "data"
+# PRAGMA user_version of the current layout
+SCHEMA_VERSION = 1
+COLUMNS = "path, is_dir, size, mtime, tag"
+
+
+def get_state_path(task_id: str):
+    return os.path.join(STATE_DIR, f"state_{task_id}.db")
+
+def get_gzip_state_path(task_id: str):
+    return os.path.join(STATE_DIR, f"state_{task_id}.json.gz")
+
+def get_legacy_state_path(task_id: str):
+    return os.path.join(STATE_DIR, f"state_{task_id}.json")
+
+
+class StateStore:
+    """Scan state of one task: a SQLite (WAL) table with one row per path.
+
+    Rows carry the parent path next to the Entry columns, so a subtree can
+    be read without loading everything, and a run only writes the rows that
+    changed (nothing at all when nothing changed). State from the older
+    state_<id>.json.gz / state_<id>.json files is imported the first time
+    the store is opened.
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.path = get_state_path(task_id)
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._create(conn)
+        return conn
+
+    def _create(self, conn):
+        """Create the table and import the old state files into it.
+
+        Whichever call opens the store first does it (a watcher event may
+        come before the first run), under a write lock so concurrent openers
+        wait and then find it done."""
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+                return
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " path TEXT PRIMARY KEY,"
+                " parent TEXT NOT NULL,"
+                " is_dir INTEGER NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " mtime REAL NOT NULL,"
+                " tag INTEGER NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            imported = self._read_old_state()
+            if imported:
+                conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                                 (self._row(k, Entry.from_dict(v)) for k, v in imported.items()))
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent)")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        if imported is not None:
+            for old_path in (get_gzip_state_path(self.task_id), get_legacy_state_path(self.task_id)):
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+            logger.info(f"Migrated {len(imported)} state entries of task {self.task_id} to {self.path}")
+
+    @staticmethod
+    def _row(path, entry):
+        return (path, get_parent_path(path), int(entry.is_dir), entry.size, entry.mtime, entry.tag)
+
+    @staticmethod
+    def _entries(rows):
+        return {path: Entry(bool(is_dir), size, mtime, tag) for path, is_dir, size, mtime, tag in rows}
+
+    def _read_old_state(self):
+        """State from state_<id>.json.gz or state_<id>.json, or None if there is none."""
+        gz_path = get_gzip_state_path(self.task_id)
+        legacy_path = get_legacy_state_path(self.task_id)
+        try:
+            if os.path.exists(gz_path):
+                with gzip.open(gz_path, "rt", encoding="utf-8") as f:
+                    return json.load(f)
+            if os.path.exists(legacy_path):
+                with open(legacy_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load old state file for task {self.task_id}: {e}, starting fresh.")
+        return None
+
+    def load(self):
+        """Whole state as a dict, in path order."""
+        conn = self._connect()
+        try:
+            return self._entries(conn.execute(f"SELECT {COLUMNS} FROM entries ORDER BY path"))
+        finally:
+            conn.close()
+
+    def subtree(self, path):
+        """Entries strictly below path (see PathIndex for the range trick)."""
+        base = path.rstrip('/')
+        conn = self._connect()
+        try:
+            return self._entries(conn.execute(f"SELECT {COLUMNS} FROM entries WHERE path > ? AND path < ? ORDER BY path",
+                                              (base + '/', base + '0')))
+        finally:
+            conn.close()
+
+    def apply(self, upserts, deletes):
+        """Write changed rows and remove deleted ones in one transaction."""
+        if not upserts and not deletes:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                if deletes:
+                    conn.executemany("DELETE FROM entries WHERE path = ?", ((p,) for p in deletes))
+                if upserts:
+                    conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                                     (self._row(k, v) for k, v in upserts.items()))
+        finally:
+            conn.close()
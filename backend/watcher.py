@@ -4,7 +4,7 @@ import time
 import os
 import logging
 from backend.services import AlistService
-from backend.models import load_config
+from backend.models import read_config
 
 logger = logging.getLogger("watcher")
 
@@ -15,32 +15,43 @@ class RefreshHandler(FileSystemEventHandler):
         self.base_path = task.src_path.rstrip('/')
         self.last_refresh = 0
         
-    def process(self, src_path, event_type):
-        if not src_path.startswith(self.base_path): return
+    def state_key(self, path):
+        """State key of a watched path (same form as the local scanner's keys)."""
+        if not path.startswith(self.base_path): return None
         
-        rel_path = src_path[len(self.base_path):]
+        rel_path = path[len(self.base_path):]
         if rel_path.startswith(os.sep): rel_path = rel_path[1:]
         rel_path = rel_path.replace('\\', '/')
+        if not rel_path: return None
+        return self.base_path + '/' + rel_path
+
+    def process(self, src_path, event_type, is_directory=False, dest_path=None):
+        key = self.state_key(src_path)
+        if key is None: return
+        dest_key = ""
+        if dest_path is not None:
+            # Moved out of the watched tree: same as a delete
+            dest_key = self.state_key(dest_path) or ""
+            if not dest_key:
+                event_type = "deleted"
         
-        logger.info(f"Local {event_type}: {src_path} -> Queued for logging")
+        logger.info(f"Local {event_type}: {src_path}{' -> ' + dest_path if dest_key else ''} -> Queued")
         
-        from backend.scan_queue import ScanQueue
-        # Add a specifically flagged EVENT job instead of a scan request
-        ScanQueue.get_instance().add_job(self.task.id, src_path, f"EVENT_{event_type.upper()}")
+        from backend.scan_queue import ScanQueue, WatchEvent
+        # Events are coalesced per directory, then patch the stored state and refresh it
+        ScanQueue.get_instance().add_event(self.task.id, WatchEvent(event_type, key, dest_key, is_directory))
 
     def on_created(self, event):
-        if event.is_directory: return
-        self.process(event.src_path, "created")
+        self.process(event.src_path, "created", event.is_directory)
 
     def on_deleted(self, event):
-        if event.is_directory: return
-        self.process(event.src_path, "deleted")
+        self.process(event.src_path, "deleted", event.is_directory)
 
     def on_moved(self, event):
-        if event.is_directory: return
-        self.process(event.dest_path, "moved")
+        self.process(event.src_path, "moved", event.is_directory, event.dest_path)
 
     def on_modified(self, event):
+        # A directory's modified event only repeats what its children report
         if event.is_directory: return
         self.process(event.src_path, "modified")
 
@@ -57,7 +68,7 @@ class WatcherManager:
     @staticmethod
     def update_watchers():
         try:
-            config = load_config()
+            config = read_config()
             # Find active LOCAL tasks
             active_tasks = [t for t in config.tasks if t.enabled and getattr(t, 'src_type', 'webdav') == 'local']
             
@@ -3,10 +3,10 @@ import time
 import json
 import logging
 import requests
-import xmltodict
 from datetime import datetime
 from apscheduler.schedulers.blocking import BlockingScheduler
 from dotenv import load_dotenv
+from backend.propfind import iter_propfind
 
 # Load environment variables
 load_dotenv()
@@ -100,42 +100,34 @@ class WebDAVScanner:
     def _list_recursive(self, path):
         """Recursively list files and directories to detect changes."""
         results = {}
+        subdirs = []
         try:
-            # WebDAV PROPFIND request
+            # WebDAV PROPFIND request, parsed incrementally as it streams in
             headers = {'Depth': '1'}
-            resp = requests.request('PROPFIND', f"{self.url}{path}", auth=self.auth, headers=headers)
+            resp = requests.request('PROPFIND', f"{self.url}{path}", auth=self.auth, headers=headers, stream=True)
             resp.raise_for_status()
             
-            content = xmltodict.parse(resp.text)
-            responses = content.get('D:multistatus', {}).get('D:response', [])
-            
-            if isinstance(responses, dict):
-                responses = [responses]
-                
-            for res in responses:
-                href = res['D:href']
-                # Decode URL encoded paths if necessary
-                # Simplified check for directory vs file
-                prop = res['D:propstat']['D:prop'] if isinstance(res['D:propstat'], dict) else res['D:propstat'][0]['D:prop']
-                
-                is_dir = 'D:collection' in prop.get('D:resourcetype', {}) if prop.get('D:resourcetype') else False
-                
-                # We skip the path itself in the listing if it's the root of the current call
-                current_href = href.rstrip('/')
-                base_path_href = path.rstrip('/')
-                # Hacky check to see if it's the current directory
-                if current_href.endswith(base_path_href):
-                    continue
+            with resp:
+                for item in iter_propfind(resp):
+                    # Still percent-encoded: it is the state key and the next request's URL
+                    href = item['raw_href']
+                    
+                    # We skip the path itself in the listing if it's the root of the current call
+                    current_href = href.rstrip('/')
+                    base_path_href = path.rstrip('/')
+                    # Hacky check to see if it's the current directory
+                    if current_href.endswith(base_path_href):
+                        continue
 
-                if is_dir:
-                    # Recursive call
-                    sub_results = self._list_recursive(href[len(self.url):] if href.startswith(self.url) else href)
-                    results.update(sub_results)
-                else:
-                    # It's a file
-                    size = prop.get('D:getcontentlength', '0')
-                    mtime = prop.get('D:getlastmodified', '')
-                    results[href] = {"size": size, "mtime": mtime}
+                    if item['is_dir']:
+                        subdirs.append(href[len(self.url):] if href.startswith(self.url) else href)
+                    else:
+                        # It's a file
+                        results[href] = {"size": item['size'], "mtime": item['mtime']}
+            
+            # Recurse once the listing is fully read and its connection released
+            for sub_path in subdirs:
+                results.update(self._list_recursive(sub_path))
                     
         except Exception as e:
             logger.error(f"Error scanning WebDAV path {path}: {e}")